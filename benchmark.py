@@ -0,0 +1,367 @@
+# Замеры скорости операций таблицы учёта на синтетических журналах.
+#
+#   python benchmark.py                       # слой данных без интерфейса
+#   python benchmark.py --gui                 # ещё и настоящий JournalApp (при
+#                                             # отсутствии DISPLAY запускается Xvfb)
+#   python benchmark.py -o new.json --compare old.json
+#
+# Результат - JSON с медианой и минимумом времени и пиком памяти для каждой
+# операции и размера журнала; два таких файла сравниваются ключом --compare.
+
+import argparse
+import gc
+import importlib.util
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "таблица учёта.py")
+DEFAULT_ROWS = (100, 1000, 10000, 100000)
+DEFAULT_COLUMNS = (3, 20, 200)
+# 100000 x 200 - это 20 млн строк Python и несколько гигабайт памяти; такие
+# размеры включаются явно через --max-cells
+DEFAULT_MAX_CELLS = 2000000
+XVFB_START_TIMEOUT = 10
+
+def load_app_module():
+    spec = importlib.util.spec_from_file_location("journal", APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["journal"] = module
+    spec.loader.exec_module(module)
+    return module
+
+J = load_app_module()
+
+def synthetic_state(rows, columns, seed=0):
+    # Похоже на смену на линии: целые и дробные количества, пустые ячейки
+    # и изредка текстовые пометки
+    rng = random.Random(seed)
+    data = []
+    for col in range(columns):
+        values = []
+        for _ in range(rows):
+            r = rng.random()
+            if r < 0.2:
+                values.append("")
+            elif r < 0.22:
+                values.append("брак")
+            elif r < 0.6:
+                values.append(f"{rng.uniform(0, 500):.2f}")
+            else:
+                values.append(str(rng.randint(0, 1000)))
+        data.append({"header": f"Маркировка {col+1}", "values": values})
+    return {"data_rows": rows, "columns": data}
+
+def edited_state(state):
+    # Тот же журнал к концу смены: каждая десятая ячейка исправлена, последнего
+    # столбца нет, а строк на 5% больше. Восстановление такого состояния поверх
+    # исходного проходит всю сверку столбцов, а не только сравнение списков
+    rows = state["data_rows"]
+    extra = max(1, rows // 20)
+    columns = []
+    for col, data in enumerate(state["columns"][:max(1, len(state["columns"]) - 1)]):
+        values = list(data["values"])
+        for row in range(col % 10, rows, 10):
+            values[row] = f"{row % 97}.5"
+        values.extend(["7"] * extra)
+        columns.append({"header": data["header"], "values": values})
+    return {"data_rows": rows + extra, "columns": columns}
+
+def max_rss_bytes():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS - байты
+    return rss if sys.platform == "darwin" else rss * 1024
+
+def measure(case, repeat):
+    # case: (подготовка, замеряемое действие, уборка); подготовка возвращает
+    # аргумент действия. Время и память меряются в разных проходах, чтобы
+    # tracemalloc не искажал время.
+    prepare, run, cleanup = case
+    seconds = []
+    for _ in range(repeat):
+        arg = prepare() if prepare else None
+        gc.collect()
+        start = time.perf_counter()
+        run(arg)
+        seconds.append(time.perf_counter() - start)
+        if cleanup:
+            cleanup(arg)
+    arg = prepare() if prepare else None
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run(arg)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    if cleanup:
+        cleanup(arg)
+    return {
+        "seconds": seconds,
+        "median": statistics.median(seconds),
+        "min": min(seconds),
+        "peak_bytes": peak
+    }
+
+def headless_cases(state, workdir):
+    model = J.TableModel.from_state(state)
+    history = J.UndoHistory(model)
+    json_path = os.path.join(workdir, "journal.json")
+    jtb_path = os.path.join(workdir, "journal.jtb")
+    J.write_journal(model, json_path)
+    J.write_journal(model, jtb_path)
+    middle = model.data_rows // 2
+    other = edited_state(state)
+    
+    def undo(_):
+        history.undo()
+    
+    def delete_first_column():
+        history.execute(J.DeleteColumn(0, model.columns[0]))
+    
+    def edits():
+        # Десяток правленых ячеек в каждом столбце - как после смены
+        step = max(1, model.data_rows // 10)
+        return [(J.LOG_CELL, col, row, "1")
+                for col in range(len(model.columns)) for row in range(0, model.data_rows, step)]
+    
+    def reset_jtb(_):
+        J.write_journal(model, jtb_path)
+    
+    return {
+        "from_state": (None, lambda _: J.TableModel.from_state(state), None),
+        "restore_state": (lambda: other, model.load_state, lambda _: model.load_state(state)),
+        "prepare_save_data": (None, lambda _: model.to_state(), None),
+        "update_sum": (None, lambda _: [model.total(col) for col in range(len(model.columns))], None),
+        "edit_cell": (None, lambda _: history.execute(J.CellEdit(0, middle, model.value(0, middle), "42")), undo),
+        "add_row": (None, lambda _: history.execute(J.InsertRows(model.data_rows)), undo),
+        "delete_row": (None, lambda _: history.execute(J.DeleteRows(middle)), undo),
+        "delete_column": (None, lambda _: delete_first_column(), undo),
+        "undo_action": (delete_first_column, undo, None),
+        "save_json": (None, lambda _: J.write_journal(model, json_path), None),
+        "save_jtb": (None, lambda _: J.write_journal(model, jtb_path), None),
+        "append_jtb_log": (edits, lambda changes: J.append_columnar_log(jtb_path, changes), reset_jtb),
+        "load_json": (None, lambda _: J.read_journal(json_path), None),
+        "load_jtb": (None, lambda _: J.read_journal(jtb_path), None),
+        "jtb_totals": (None, lambda _: J.read_columnar_totals(jtb_path), None)
+    }
+
+def pump(app):
+    # Отложенные кадры отрисовки и обработка геометрии входят в замер
+    app.scheduler.flush()
+    app.update()
+
+def wait_loaded(app):
+    while app.loader is not None:
+        app.update()
+        time.sleep(0.001)
+    pump(app)
+
+def gui_cases(app, state, workdir):
+    json_path = os.path.join(workdir, "journal.json")
+    jtb_path = os.path.join(workdir, "journal.jtb")
+    J.write_journal_file(state, json_path)
+    J.write_journal_file(state, jtb_path)
+    app.open_file(json_path)
+    wait_loaded(app)
+    middle = app.data_rows // 2
+    other = edited_state(state)
+    
+    def act(func, *args):
+        def run(_):
+            func(*args)
+            pump(app)
+        return run
+    
+    def undo(_):
+        app.undo_action()
+        pump(app)
+    
+    def delete_first_column():
+        app.delete_column(0)
+        pump(app)
+    
+    def update_sum(_):
+        # Без сброса запомненного текста update_sum ничего не пишет в виджеты
+        app._shown_text.clear()
+        app.update_all_sums()
+        pump(app)
+    
+    def open_file(path):
+        def run(_):
+            app.open_file(path)
+            wait_loaded(app)
+        return run
+    
+    def quick_save(path):
+        def prepare():
+            app.current_file = path
+            app.changes.reset(path if J.is_columnar_path(path) else None)
+            app.execute(J.CellEdit(0, middle, app.model.value(0, middle), str(time.perf_counter())))
+        
+        def run(_):
+            app.quick_save()
+            app.save_worker.wait()
+        return prepare, run, None
+    
+    return {
+        "restore_state": (None, act(app.restore_state, other), act(app.restore_state, state)),
+        "prepare_save_data": (None, lambda _: app.prepare_save_data(), None),
+        "update_sum": (None, update_sum, None),
+        "add_row": (None, act(app.add_row), undo),
+        "delete_row": (None, act(app.delete_row, middle), undo),
+        "delete_column": (None, lambda _: delete_first_column(), undo),
+        "undo_action": (delete_first_column, undo, None),
+        "scroll_page": (None, act(app.scrollable_table.scroll_to, middle), act(app.scrollable_table.scroll_to, 0)),
+        "quick_save_json": quick_save(json_path),
+        "quick_save_jtb": quick_save(jtb_path),
+        "open_json": (None, open_file(json_path), None),
+        "open_jtb": (None, open_file(jtb_path), None)
+    }
+
+def start_xvfb():
+    # Виртуальный X-сервер нужен только там, где нет дисплея (сборочный сервер)
+    if os.environ.get("DISPLAY") or sys.platform in ("win32", "darwin"):
+        return None
+    xvfb = shutil.which("Xvfb")
+    if not xvfb:
+        raise SystemExit("Нет DISPLAY и не найден Xvfb: установите Xvfb или запустите через xvfb-run")
+    number = 100 + os.getpid() % 400
+    proc = subprocess.Popen([xvfb, f":{number}", "-screen", "0", "1280x1024x24", "-nolisten", "tcp"],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    socket_path = f"/tmp/.X11-unix/X{number}"
+    deadline = time.monotonic() + XVFB_START_TIMEOUT
+    while not os.path.exists(socket_path):
+        if proc.poll() is not None or time.monotonic() > deadline:
+            proc.kill()
+            raise SystemExit("Не удалось запустить Xvfb")
+        time.sleep(0.05)
+    os.environ["DISPLAY"] = f":{number}"
+    return proc
+
+def git_revision():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(APP_PATH),
+                             capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+def parse_sizes(text):
+    return tuple(int(part) for part in text.split(",") if part.strip())
+
+def run_benchmarks(args):
+    results = []
+    selected = set(args.only.split(",")) if args.only else None
+    
+    def report(mode, rows, columns, name, result):
+        result.update({"mode": mode, "rows": rows, "columns": columns, "operation": name})
+        results.append(result)
+        print(f"{mode:8} {rows:>7}x{columns:<4} {name:18} {result['median']*1000:10.2f} мс"
+              f" {result['peak_bytes']/1024/1024:9.1f} МиБ", flush=True)
+    
+    app = None
+    if args.gui:
+        # Автосохранения и чужие файлы восстановления из домашней папки замер не трогает
+        app = J.JournalApp(autosave_interval=0, recovery_dir=os.path.join(args.workdir, "recovery"))
+        app.update()
+    try:
+        for rows in args.rows:
+            for columns in args.columns:
+                if rows * columns > args.max_cells:
+                    continue
+                state = synthetic_state(rows, columns)
+                for name, case in headless_cases(state, args.workdir).items():
+                    if selected is None or name in selected:
+                        report("headless", rows, columns, name, measure(case, args.repeat))
+                if app is not None:
+                    for name, case in gui_cases(app, state, args.workdir).items():
+                        if selected is None or name in selected:
+                            report("gui", rows, columns, name, measure(case, args.repeat))
+    finally:
+        if app is not None:
+            app.close_now()
+            # Файлы сеанса восстановления удаляются в фоне; рабочая папка - после них
+            app.save_worker.executor.shutdown(wait=True)
+    return results
+
+def compare(results, baseline_path, threshold):
+    # Возвращает число операций, ставших медленнее порога
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    key = lambda r: (r["mode"], r["rows"], r["columns"], r["operation"])
+    old = {key(r): r for r in baseline.get("results", [])}
+    regressions = 0
+    print(f"\nСравнение с {baseline_path} ({baseline.get('meta', {}).get('revision')}):")
+    for result in results:
+        before = old.get(key(result))
+        if not before or not before["median"]:
+            continue
+        ratio = result["median"] / before["median"]
+        mark = ""
+        if ratio > 1 + threshold:
+            mark = "  медленнее"
+            regressions += 1
+        elif ratio < 1 - threshold:
+            mark = "  быстрее"
+        print(f"{result['mode']:8} {result['rows']:>7}x{result['columns']:<4} {result['operation']:18} x{ratio:6.2f}{mark}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры скорости таблицы учёта на синтетических журналах")
+    parser.add_argument("--rows", type=parse_sizes, default=DEFAULT_ROWS, help="числа строк через запятую")
+    parser.add_argument("--columns", type=parse_sizes, default=DEFAULT_COLUMNS, help="числа столбцов через запятую")
+    parser.add_argument("--max-cells", type=int, default=DEFAULT_MAX_CELLS, help="пропускать журналы крупнее")
+    parser.add_argument("--repeat", type=int, default=5, help="повторов каждой операции")
+    parser.add_argument("--only", default=None, help="только перечисленные операции (через запятую)")
+    parser.add_argument("--gui", action="store_true", help="мерить также настоящий JournalApp")
+    parser.add_argument("-o", "--output", default=None, help="файл результатов JSON")
+    parser.add_argument("--compare", default=None, help="результаты прошлой версии для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.2, help="допустимое замедление (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+    
+    xvfb = start_xvfb() if args.gui else None
+    try:
+        with tempfile.TemporaryDirectory(prefix="journal-bench-") as workdir:
+            args.workdir = workdir
+            results = run_benchmarks(args)
+    finally:
+        if xvfb is not None:
+            xvfb.terminate()
+            xvfb.wait()
+    
+    output = {
+        "meta": {
+            "revision": git_revision(),
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "max_rss_bytes": max_rss_bytes()
+        },
+        "results": results
+    }
+    if args.output:
+        J.atomic_write(args.output, lambda f: json.dump(output, f, ensure_ascii=False, indent=4))
+    if args.compare:
+        return 1 if compare(results, args.compare, args.threshold) else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
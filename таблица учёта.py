@@ -1,14 +1,1342 @@
+import time
+STARTUP_T0 = time.perf_counter()
+
 import tkinter as tk
-from tkinter import filedialog, messagebox, ttk
+from tkinter import filedialog, messagebox, simpledialog, ttk
+import bisect
+import csv
+import fnmatch
+import functools
+import io
 import json
-import copy
+import math
+import mmap
 import os
+import struct
 import sys
+import threading
+import zlib
+from array import array
+from collections import deque
+from itertools import accumulate, zip_longest
+from contextlib import contextmanager
+# argparse, multiprocessing, concurrent.futures, tempfile и shutil нужны не при
+# каждом запуске и заметно удлиняют холодный старт exe; они импортируются там,
+# где используются
+
+NAN = float("nan")
+# Права новых файлов при обычном open(); umask читается один раз, пока нет потоков
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+UNDO_MEMORY_LIMIT = 32 * 1024 * 1024
+FRAME_MS = 16
+TYPING_QUIET_MS = 800
+AUTOSAVE_INTERVAL_MS = 2 * 60 * 1000
+LOAD_CHUNK_CELLS = 50000
+COMPACT_MIN_BYTES = 256 * 1024
+SHEET_MEMORY_LIMIT = 256 * 1024 * 1024
+SCAN_POLL_MS = 100
+# Сколько строк индекс и дерево агрегатов обновляют построчно; больше - пачкой
+CACHE_BULK_ROWS = 64
+# Длина блока строк, по которым хранятся итоги столбца
+AGGREGATE_BLOCK_ROWS = 512
+# Необязательные строки итогов под строкой сумм
+SUMMARY_STATS = (("count", "Кол-во"), ("min", "Мин."), ("max", "Макс."), ("mean", "Среднее"))
+PROFILE_ENV = "JOURNAL_PROFILE"
+PROFILE_HEARTBEAT_MS = 100
+PROFILE_SAMPLE_MS = 1000
+PROFILE_TRACE_LIMIT = 200000
+# Верхние границы корзин гистограммы задержек, мс; последняя корзина - всё, что дольше
+LATENCY_BUCKETS_MS = (0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048)
+RECOVERY_DIR = os.path.join(os.path.expanduser("~"), ".таблица_учёта.recovery")
+AGGREGATE_CACHE = ".таблица_учёта.cache.json"
+AGGREGATE_CACHE_VERSION = 1
+AGGREGATE_INFLIGHT = 4
+
+def parse_number(text):
+    text = text.strip()
+    if not text:
+        return NAN
+    try:
+        value = float(text)
+    except ValueError:
+        return NAN
+    # inf и nan не участвуют в сумме, иначе точная сумма перестаёт быть точной
+    return value if math.isfinite(value) else NAN
+
+class ExactSum:
+    # Накопитель без потери точности (частичные суммы Шевчука, как в math.fsum):
+    # добавление и вычитание одного значения не копят ошибку округления.
+    __slots__ = ("partials",)
+    
+    def __init__(self, values=()):
+        self.partials = []
+        for x in values:
+            self.add(x)
+    
+    def add(self, x):
+        partials = self.partials
+        if partials and math.isinf(partials[-1]):
+            # После переполнения сумма остаётся ±inf, как у обычного сложения
+            return
+        i = 0
+        for y in partials:
+            if abs(x) < abs(y):
+                x, y = y, x
+            hi = x + y
+            lo = y - (hi - x)
+            if lo:
+                partials[i] = lo
+                i += 1
+            x = hi
+        if math.isinf(x):
+            partials[:] = [x]
+            return
+        partials[i:] = [x]
+    
+    def value(self):
+        return float_sum(self.partials)
+
+def float_sum(values):
+    # math.fsum для списка конечных чисел; если сумма не помещается во float,
+    # fsum бросает исключение, а результат будет ±inf (или nan), как у sum()
+    try:
+        return math.fsum(values)
+    except (OverflowError, ValueError):
+        return sum(values)
+
+class Column:
+    # Исходные строки хранятся вместе с разобранными числами; NaN означает
+    # пустую или нечисловую ячейку. Сумма поддерживается по разнице old→new.
+    __slots__ = ("header", "raw", "nums", "sum")
+    
+    def __init__(self, header, values=()):
+        self.header = header
+        self.raw = list(values)
+        self.nums = array("d", map(parse_number, self.raw))
+        self.sum = ExactSum(x for x in self.nums if x == x)
+    
+    def set(self, row, text):
+        old = self.nums[row]
+        new = parse_number(text)
+        self.raw[row] = text
+        self.nums[row] = new
+        if old == old:
+            self.sum.add(-old)
+        if new == new:
+            self.sum.add(new)
+    
+    def insert_many(self, row, texts):
+        nums = array("d", map(parse_number, texts))
+        self.raw[row:row] = texts
+        self.nums[row:row] = nums
+        for value in nums:
+            if value == value:
+                self.sum.add(value)
+    
+    def assign(self, values):
+        # Переписываются только отличающиеся ячейки, сумма меняется по разнице
+        raw = self.raw
+        if raw == values:
+            return
+        common = min(len(raw), len(values))
+        for row in range(common):
+            if raw[row] != values[row]:
+                self.set(row, values[row])
+        if len(raw) > common:
+            self.delete_many(common, len(raw) - common)
+        self.insert_many(common, values[common:])
+    
+    def set_range(self, row, texts):
+        old = self.raw[row:row + len(texts)]
+        for i, text in enumerate(texts):
+            if old[i] != text:
+                self.set(row + i, text)
+        return old
+    
+    def delete_many(self, row, count):
+        removed = self.raw[row:row + count]
+        for value in self.nums[row:row + count]:
+            if value == value:
+                self.sum.add(-value)
+        del self.raw[row:row + count]
+        del self.nums[row:row + count]
+        return removed
+    
+    def total(self):
+        total = self.sum.value()
+        if math.isinf(total):
+            # Накопитель после переполнения не уменьшается; пересчёт вернёт
+            # конечную сумму, если слишком большие числа уже удалены
+            self.sum = ExactSum(x for x in self.nums if x == x)
+            total = self.sum.value()
+        return total
+    
+    def subtotal(self, rows):
+        nums = self.nums
+        return float_sum([x for x in map(nums.__getitem__, rows) if x == x])
+    
+    @classmethod
+    def from_parts(cls, header, raw, nums):
+        # Готовые разобранные числа (например, из компактного файла) не разбираются повторно
+        column = cls.__new__(cls)
+        column.header = header
+        column.raw = raw
+        column.nums = nums
+        column.sum = ExactSum(x for x in nums if x == x)
+        return column
+
+class TableModel:
+    # Данные журнала без виджетов: заголовки, значения и суммы. Представление
+    # подписывается через subscribe() и получает (событие, столбец, строка).
+    def __init__(self, columns=3, rows=1):
+        self.data_rows = rows
+        self.columns = [Column(f"Столбец {i+1}", [""] * rows) for i in range(columns)]
+        self.listeners = []
+        self.exact_listeners = []
+        self._batch_depth = 0
+        self._batch_changed = False
+    
+    def subscribe(self, callback, exact=False):
+        # exact - получать каждое событие сразу, в том числе внутри пакета, и не
+        # получать "reset" по его окончании: так подписываются кэши, которые
+        # обновляются на месте (индекс поиска, дерево агрегатов)
+        (self.exact_listeners if exact else self.listeners).append(callback)
+    
+    def unsubscribe(self, callback):
+        if callback in self.exact_listeners:
+            self.exact_listeners.remove(callback)
+        else:
+            self.listeners.remove(callback)
+    
+    def notify(self, event, col=None, row=None, count=1):
+        for callback in list(self.exact_listeners):
+            callback(event, col, row, count)
+        if self._batch_depth:
+            self._batch_changed = True
+            return
+        for callback in list(self.listeners):
+            callback(event, col, row, count)
+    
+    @contextmanager
+    def batch(self):
+        # Внутри пакета уведомления не рассылаются; по его окончании
+        # подписчики получают одно событие "reset" и сверяются с моделью целиком
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth and self._batch_changed:
+                self._batch_changed = False
+                for callback in list(self.listeners):
+                    callback("reset", None, None, 1)
+    
+    def value(self, col, row):
+        return self.columns[col].raw[row]
+    
+    def header(self, col):
+        return self.columns[col].header
+    
+    def total(self, col):
+        return self.columns[col].total()
+    
+    def subtotal(self, col, rows):
+        return self.columns[col].subtotal(rows)
+    
+    def set_value(self, col, row, text):
+        column = self.columns[col]
+        if column.raw[row] == text:
+            return False
+        column.set(row, text)
+        self.notify("cell", col, row)
+        return True
+    
+    def set_header(self, col, text):
+        if self.columns[col].header == text:
+            return False
+        self.columns[col].header = text
+        self.notify("header", col)
+        return True
+    
+    def set_block(self, col, row, block):
+        # block: значения по столбцам, начиная с ячейки (col, row); возвращает прежние
+        with self.batch():
+            old = []
+            for offset, texts in enumerate(block):
+                old.append(self.columns[col + offset].set_range(row, texts))
+                self.notify("cells", col + offset, row, len(texts))
+        return old
+    
+    def new_column(self, header=None):
+        if header is None:
+            header = f"Столбец {len(self.columns)+1}"
+        return Column(header, [""] * self.data_rows)
+    
+    def insert_column(self, col, column):
+        self.columns.insert(col, column)
+        self.notify("insert_column", col)
+    
+    def add_column(self, header=None):
+        col = len(self.columns)
+        self.insert_column(col, self.new_column(header))
+        return col
+    
+    def delete_column(self, col):
+        column = self.columns.pop(col)
+        self.notify("delete_column", col)
+        return column
+    
+    def insert_rows(self, row, count=1, values=None):
+        # values: для каждого столбца список из count строк
+        for col, column in enumerate(self.columns):
+            column.insert_many(row, values[col] if values else [""] * count)
+        self.data_rows += count
+        self.notify("insert_rows", None, row, count)
+    
+    def add_row(self):
+        row = self.data_rows
+        self.insert_rows(row)
+        return row
+    
+    def delete_rows(self, row, count=1):
+        values = [column.delete_many(row, count) for column in self.columns]
+        self.data_rows -= count
+        self.notify("delete_rows", None, row, count)
+        return values
+    
+    def to_state(self):
+        return {
+            "data_rows": self.data_rows,
+            "columns": [{"header": column.header, "values": list(column.raw)}
+                        for column in self.columns]
+        }
+    
+    @staticmethod
+    def normalize_state(state):
+        # Возвращает (число строк, [(заголовок, значения одинаковой длины)])
+        data_rows = state.get("data_rows", 1)
+        col_data = state.get("columns", [])
+        for data in col_data:
+            data_rows = max(data_rows, len(data.get("values", [])))
+        columns = []
+        for col_index, data in enumerate(col_data):
+            # Файл могли собрать скриптом или поправить руками: числа и null
+            # в ячейках приводятся к тексту, как их показало бы поле ввода
+            values = [cell_text(value) for value in data.get("values", [])]
+            values.extend([""] * (data_rows - len(values)))
+            columns.append((cell_text(data.get("header", f"Столбец {col_index+1}")), values))
+        return data_rows, columns
+    
+    def load_state(self, state):
+        data_rows, col_data = self.normalize_state(state)
+        # Существующие столбцы сверяются с новым состоянием на месте
+        for col_index, (header, values) in enumerate(col_data):
+            if col_index < len(self.columns):
+                self.columns[col_index].header = header
+                self.columns[col_index].assign(values)
+            else:
+                self.columns.append(Column(header, values))
+        del self.columns[len(col_data):]
+        self.data_rows = data_rows
+        self.notify("reset")
+    
+    @classmethod
+    def from_state(cls, state):
+        model = cls(columns=0)
+        model.load_state(state)
+        return model
+
+def cell_text(value):
+    return "" if value is None else value if isinstance(value, str) else str(value)
+
+def parse_clipboard_block(text):
+    # Блок из Excel: строки через перевод строки, ячейки через табуляцию;
+    # кавычки и переводы строк внутри ячеек разбирает csv. Многострочный текст
+    # без табуляций считается CSV через ";", только если во всех непустых
+    # строках одинаковое число полей, иначе каждая строка - одна ячейка (столбец
+    # из Excel с ";" внутри текста). Одна строка без табуляций - всегда одна
+    # ячейка: так вставляется обычный текст вроде "брак; пересорт"
+    text = text.rstrip("\r\n")
+    rows = list(csv.reader(io.StringIO(text), delimiter="\t"))
+    if "\t" not in text and "\n" in text:
+        fields = list(csv.reader(io.StringIO(text), delimiter=";"))
+        if len({len(row) for row in fields if row}) == 1:
+            rows = fields
+    return [list(col) for col in zip_longest(*rows, fillvalue="")]
+
+def row_ranges(rows):
+    # Отсортированные непрерывные диапазоны (начало, количество)
+    ranges = []
+    for row in sorted(set(rows)):
+        if ranges and ranges[-1][0] + ranges[-1][1] == row:
+            ranges[-1][1] += 1
+        else:
+            ranges.append([row, 1])
+    return [tuple(r) for r in ranges]
+
+def text_size(values):
+    # Грубая оценка памяти под строки: заголовок объекта str плюс ссылка в списке
+    return 57 * len(values) + sum(map(len, values))
+
+# Записи истории хранят только изменённые данные и умеют применять и
+# откатывать себя на модели, не пересоздавая остальную таблицу.
+class CellEdit:
+    __slots__ = ("col", "row", "old", "new", "size")
+    
+    def __init__(self, col, row, old, new):
+        self.col = col
+        self.row = row
+        self.old = old
+        self.new = new
+        self.size = 120 + text_size((old, new))
+    
+    def apply(self, model):
+        model.set_value(self.col, self.row, self.new)
+    
+    def revert(self, model):
+        model.set_value(self.col, self.row, self.old)
+
+class HeaderEdit:
+    __slots__ = ("col", "old", "new", "size")
+    
+    def __init__(self, col, old, new):
+        self.col = col
+        self.old = old
+        self.new = new
+        self.size = 110 + text_size((old, new))
+    
+    def apply(self, model):
+        model.set_header(self.col, self.new)
+    
+    def revert(self, model):
+        model.set_header(self.col, self.old)
+
+class SetBlock:
+    __slots__ = ("col", "row", "old", "new", "size")
+    
+    def __init__(self, col, row, new):
+        self.col = col
+        self.row = row
+        self.old = None
+        self.new = new
+        self.size = 100 + 2 * sum(text_size(texts) for texts in new)
+    
+    def apply(self, model):
+        # Как и у InsertColumn, запись хранит только значения, которых нет в модели
+        self.old = model.set_block(self.col, self.row, self.new)
+        self.new = None
+        self.size = 100 + sum(text_size(texts) for texts in self.old)
+    
+    def revert(self, model):
+        self.new = model.set_block(self.col, self.row, self.old)
+        self.old = None
+        self.size = 100 + sum(text_size(texts) for texts in self.new)
+
+class InsertColumn:
+    # Столбец хранится в записи, только пока его нет в модели: после вставки
+    # ссылка сбрасывается, иначе история держала бы данные вытесненного на
+    # диск листа, а после чтения из кэша вкладок - вторую копию столбца
+    __slots__ = ("col", "column", "size")
+    
+    def __init__(self, col, column):
+        self.col = col
+        self.column = column
+        self.size = 200 + text_size(column.raw) + 8 * len(column.nums)
+    
+    def apply(self, model):
+        model.insert_column(self.col, self.column)
+        self.column = None
+        self.size = 200
+    
+    def revert(self, model):
+        self.column = model.delete_column(self.col)
+        self.size = 200 + text_size(self.column.raw) + 8 * len(self.column.nums)
+
+class DeleteColumn(InsertColumn):
+    __slots__ = ()
+    
+    def apply(self, model):
+        InsertColumn.revert(self, model)
+    
+    def revert(self, model):
+        InsertColumn.apply(self, model)
+
+class InsertRows:
+    __slots__ = ("row", "count", "values", "size")
+    
+    def __init__(self, row, count=1, values=None):
+        self.row = row
+        self.count = count
+        self.values = values
+        self.size = 100 + sum(text_size(col_values) for col_values in values or ())
+    
+    def apply(self, model):
+        model.insert_rows(self.row, self.count, self.values)
+    
+    def revert(self, model):
+        model.delete_rows(self.row, self.count)
+
+class DeleteRows(InsertRows):
+    # Удалённые значения запоминаются при применении записи
+    __slots__ = ()
+    
+    def apply(self, model):
+        self.values = model.delete_rows(self.row, self.count)
+        self.size = 100 + sum(text_size(col_values) for col_values in self.values)
+    
+    def revert(self, model):
+        InsertRows.apply(self, model)
+
+class Batch:
+    __slots__ = ("records", "size")
+    
+    def __init__(self, records):
+        self.records = list(records)
+        self.size = 80 + sum(record.size for record in self.records)
+    
+    def apply(self, model):
+        with model.batch():
+            for record in self.records:
+                record.apply(model)
+        self.size = 80 + sum(record.size for record in self.records)
+    
+    def revert(self, model):
+        with model.batch():
+            for record in reversed(self.records):
+                record.revert(model)
+
+class UndoHistory:
+    # Ограничение задаётся объёмом памяти под записи, а не их количеством;
+    # самая старая запись вытесняется первой, последняя сохраняется всегда.
+    def __init__(self, model, memory_limit=UNDO_MEMORY_LIMIT):
+        self.model = model
+        self.memory_limit = memory_limit
+        self.memory = 0
+        self.undo_stack = deque()
+        self.redo_stack = []
+    
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.memory = 0
+    
+    def record(self, record):
+        self.undo_stack.append(record)
+        self.memory += record.size
+        for dropped in self.redo_stack:
+            self.memory -= dropped.size
+        self.redo_stack.clear()
+        while self.memory > self.memory_limit and len(self.undo_stack) > 1:
+            self.memory -= self.undo_stack.popleft().size
+    
+    def execute(self, record):
+        record.apply(self.model)
+        self.record(record)
+    
+    def undo(self):
+        if not self.undo_stack:
+            return None
+        record = self.undo_stack.pop()
+        record.revert(self.model)
+        self.redo_stack.append(record)
+        return record
+    
+    def redo(self):
+        if not self.redo_stack:
+            return None
+        record = self.redo_stack.pop()
+        record.apply(self.model)
+        self.undo_stack.append(record)
+        return record
+
+def is_columnar_file(path):
+    with open(path, "rb") as f:
+        return f.read(len(COLUMNAR_MAGIC)) == COLUMNAR_MAGIC
+
+def read_state(path):
+    if is_columnar_file(path):
+        return read_columnar_state(path)
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def read_journal_source(path):
+    # Для окна, в потоке загрузки: компактный файл сразу даёт модель с уже
+    # разобранными числами, из JSON - приведённые к тексту (число строк,
+    # столбцы), которые окно добавляет в модель частями
+    if is_columnar_file(path):
+        return read_columnar_model(path)
+    with open(path, "r", encoding="utf-8") as f:
+        return TableModel.normalize_state(json.load(f))
+
+def read_journal(path):
+    return TableModel.from_state(read_state(path))
+
+def atomic_write(path, writer, binary=False, newline=None):
+    # Запись во временный файл рядом с целевым и атомарная замена: при сбое
+    # посреди записи прежний файл остаётся целым
+    import tempfile
+    directory = os.path.dirname(os.path.abspath(path))
+    # mkstemp создаёт файл с правами 0600; замена не должна менять права
+    # общего журнала, поэтому они переносятся с прежнего файла
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = 0o666 & ~_UMASK
+    fd, tmp_path = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=directory)
+    try:
+        with (os.fdopen(fd, "wb") if binary else os.fdopen(fd, "w", encoding="utf-8", newline=newline)) as f:
+            writer(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def write_state_atomic(state, path):
+    atomic_write(path, lambda f: json.dump(state, f, ensure_ascii=False, indent=4))
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def lock_file(f):
+    # Неблокирующая исключительная блокировка; OSError, если файл уже заблокирован.
+    # Блокировка снимается при закрытии файла, в том числе при падении процесса
+    if os.name == "nt":
+        import msvcrt
+        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+class RecoverySession:
+    # Автосохранения безымянных журналов лежат в общей папке под именами
+    # «сеанс-ключ.json». Пока процесс жив, он держит блокировку на файле
+    # «сеанс.lock»: файлы сеансов без блокировки остались после аварийного
+    # завершения, а автосохранения работающих копий программы не трогаются
+    def __init__(self, directory=RECOVERY_DIR):
+        self.directory = directory
+        self.name = f"{os.getpid()}.{time.time_ns()}"
+        self.lock = None
+    
+    def lock_path(self, session):
+        return os.path.join(self.directory, session + ".lock")
+    
+    def path(self, key):
+        if self.lock is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.lock = open(self.lock_path(self.name), "wb")
+            lock_file(self.lock)
+        return os.path.join(self.directory, f"{self.name}-{key}.json")
+    
+    def session_alive(self, session):
+        try:
+            with open(self.lock_path(session), "ab") as f:
+                lock_file(f)
+        except OSError:
+            return True
+        return False
+    
+    def adopt_orphans(self):
+        # Переносит файлы завершившихся сеансов в свой сеанс и возвращает их пути.
+        # Если две копии программы запускаются одновременно, файл достаётся той,
+        # чьё переименование прошло первым
+        try:
+            names = sorted(os.listdir(self.directory))
+        except FileNotFoundError:
+            return []
+        alive = {self.name}
+        dead = set()
+        adopted = []
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            session = name.rpartition("-")[0]
+            if session in alive:
+                continue
+            if session not in dead:
+                if self.session_alive(session):
+                    alive.add(session)
+                    continue
+                dead.add(session)
+            path = self.path(f"восстановлено{len(adopted) + 1}")
+            try:
+                os.replace(os.path.join(self.directory, name), path)
+            except FileNotFoundError:
+                continue
+            adopted.append(path)
+        for session in dead:
+            try:
+                os.remove(self.lock_path(session))
+            except OSError:
+                pass
+        return adopted
+    
+    def close(self):
+        if self.lock is not None:
+            self.lock.close()
+            self.lock = None
+            remove_file(self.lock_path(self.name))
+
+def is_columnar_path(path):
+    return path.lower().endswith(COLUMNAR_EXT)
+
+def write_journal_file(state, path):
+    if is_columnar_path(path):
+        write_columnar(state, path)
+    else:
+        write_state_atomic(state, path)
+
+def write_journal(model, path):
+    write_journal_file(model.to_state(), path)
+
+# Компактный формат (.jtb), все числа little-endian:
+#   заголовок файла: магия, версия, флаги, число строк, число столбцов,
+#     смещение конца основной части (за ним идёт журнал изменений);
+#   каталог столбцов: смещение и длина блока, итог столбца и число чисел;
+#   блок столбца: длина и текст заголовка, числа float64 (NaN — не число),
+#     длины строк в символах uint32 и сами строки одним UTF-8 фрагментом;
+#   журнал изменений: кадры (длина, crc32, записи); запись — вид, столбец,
+#     строка, длина текста в байтах и текст. Недописанный кадр игнорируется.
+COLUMNAR_MAGIC = b"JTBL"
+COLUMNAR_VERSION = 1
+COLUMNAR_EXT = ".jtb"
+LOG_CELL = 1
+LOG_HEADER = 2
+_FILE_HEADER = struct.Struct("<4sHHQIQ")
+_DIR_ENTRY = struct.Struct("<QQdQ")
+_FRAME = struct.Struct("<II")
+_LOG_RECORD = struct.Struct("<BIII")
+
+def _le_array(typecode, data=b""):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+def _le_bytes(values):
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def write_columnar(state, path):
+    data_rows, col_data = TableModel.normalize_state(state)
+    blocks = []
+    entries = []
+    offset = _FILE_HEADER.size + _DIR_ENTRY.size * len(col_data)
+    for header, values in col_data:
+        nums = array("d", map(parse_number, values))
+        numbers = [x for x in nums if x == x]
+        header_bytes = header.encode("utf-8")
+        block = b"".join((
+            struct.pack("<I", len(header_bytes)), header_bytes,
+            _le_bytes(nums),
+            _le_bytes(array("I", map(len, values))),
+            "".join(values).encode("utf-8"),
+        ))
+        entries.append(_DIR_ENTRY.pack(offset, len(block), float_sum(numbers), len(numbers)))
+        blocks.append(block)
+        offset += len(block)
+    
+    def writer(f):
+        f.write(_FILE_HEADER.pack(COLUMNAR_MAGIC, COLUMNAR_VERSION, 0, data_rows, len(col_data), offset))
+        f.writelines(entries)
+        f.writelines(blocks)
+    
+    atomic_write(path, writer, binary=True)
+
+def _columnar_layout(mm):
+    magic, version, _, data_rows, n_cols, base_end = _FILE_HEADER.unpack_from(mm, 0)
+    if magic != COLUMNAR_MAGIC or version != COLUMNAR_VERSION:
+        raise ValueError("Неизвестный формат файла")
+    entries = [_DIR_ENTRY.unpack_from(mm, _FILE_HEADER.size + i * _DIR_ENTRY.size) for i in range(n_cols)]
+    return data_rows, entries, base_end
+
+def _column_header(mm, offset):
+    (length,) = struct.unpack_from("<I", mm, offset)
+    return mm[offset + 4:offset + 4 + length].decode("utf-8"), offset + 4 + length
+
+def _iter_frames(mm, base_end):
+    # Целые кадры журнала изменений по порядку; повреждённый хвост отбрасывается
+    pos = base_end
+    while pos + _FRAME.size <= len(mm):
+        length, crc = _FRAME.unpack_from(mm, pos)
+        payload = mm[pos + _FRAME.size:pos + _FRAME.size + length]
+        if len(payload) != length or zlib.crc32(payload) != crc:
+            return
+        pos += _FRAME.size + length
+        yield payload, pos
+
+def _iter_log(mm, base_end):
+    for payload, _ in _iter_frames(mm, base_end):
+        length = len(payload)
+        at = 0
+        while at < length:
+            kind, col, row, size = _LOG_RECORD.unpack_from(payload, at)
+            at += _LOG_RECORD.size
+            yield kind, col, row, payload[at:at + size].decode("utf-8")
+            at += size
+
+def columnar_layout(path):
+    # (конец основной части, размер файла) — по ним решается, пора ли уплотнять
+    with open(path, "rb") as f:
+        header = f.read(_FILE_HEADER.size)
+        size = os.fstat(f.fileno()).st_size
+    magic, version, _, _, _, base_end = _FILE_HEADER.unpack(header)
+    if magic != COLUMNAR_MAGIC or version != COLUMNAR_VERSION:
+        raise ValueError("Неизвестный формат файла")
+    return base_end, size
+
+def read_columnar_columns(path):
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        data_rows, entries, base_end = _columnar_layout(mm)
+        columns = []
+        for offset, length, _, _ in entries:
+            header, pos = _column_header(mm, offset)
+            nums = _le_array("d", mm[pos:pos + 8 * data_rows])
+            pos += 8 * data_rows
+            lengths = _le_array("I", mm[pos:pos + 4 * data_rows])
+            pos += 4 * data_rows
+            text = mm[pos:offset + length].decode("utf-8")
+            raw = []
+            at = 0
+            for size in lengths:
+                raw.append(text[at:at + size])
+                at += size
+            columns.append(Column.from_parts(header, raw, nums))
+        for kind, col, row, text in _iter_log(mm, base_end):
+            if col >= len(columns) or (kind == LOG_CELL and row >= data_rows):
+                break
+            if kind == LOG_HEADER:
+                columns[col].header = text
+            else:
+                columns[col].set(row, text)
+    return data_rows, columns
+
+def read_columnar_state(path):
+    data_rows, columns = read_columnar_columns(path)
+    return {
+        "data_rows": data_rows,
+        "columns": [{"header": column.header, "values": column.raw} for column in columns]
+    }
+
+def read_columnar_model(path):
+    data_rows, columns = read_columnar_columns(path)
+    model = TableModel(columns=0, rows=data_rows)
+    model.columns = columns
+    return model
+
+def read_columnar_totals(path):
+    # Итоги по столбцам без разбора строк: каталог даёт итоги основной части,
+    # а по журналу изменений итог поправляется на разность старого и нового числа
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        data_rows, entries, base_end = _columnar_layout(mm)
+        headers = []
+        sums = []
+        nums_at = []
+        for offset, _, total, _ in entries:
+            header, pos = _column_header(mm, offset)
+            headers.append(header)
+            sums.append(ExactSum((total,)))
+            nums_at.append(pos)
+        current = {}
+        for kind, col, row, text in _iter_log(mm, base_end):
+            if col >= len(headers) or (kind == LOG_CELL and row >= data_rows):
+                break
+            if kind == LOG_HEADER:
+                headers[col] = text
+                continue
+            old = current.get((col, row))
+            if old is None:
+                old = _le_array("d", mm[nums_at[col] + 8 * row:nums_at[col] + 8 * row + 8])[0]
+            new = parse_number(text)
+            if old == old:
+                sums[col].add(-old)
+            if new == new:
+                sums[col].add(new)
+            current[(col, row)] = new
+    return [(header, total.value()) for header, total in zip(headers, sums)]
+
+def append_columnar_log(path, changes):
+    # changes: [(вид, столбец, строка, текст)]; один кадр на сохранение
+    if not changes:
+        return
+    parts = []
+    for kind, col, row, text in changes:
+        data = text.encode("utf-8")
+        parts.append(_LOG_RECORD.pack(kind, col, row, len(data)))
+        parts.append(data)
+    payload = b"".join(parts)
+    with open(path, "r+b") as f:
+        # Недописанный при сбое кадр отрезается, иначе новые кадры оказались бы за ним
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            _, _, end = _columnar_layout(mm)
+            for _, end in _iter_frames(mm, end):
+                pass
+            size = len(mm)
+        if end != size:
+            f.truncate(end)
+        f.seek(end)
+        f.write(_FRAME.pack(len(payload), zlib.crc32(payload)) + payload)
+        f.flush()
+        os.fsync(f.fileno())
+
+class ChangeTracker:
+    # Запоминает правки ячеек и заголовков после последнего сохранения в
+    # компактный файл path, чтобы дописать в его журнал только их; любое
+    # структурное изменение требует полной перезаписи
+    def __init__(self):
+        self.model = None
+        self.path = None
+        self.cells = set()
+        self.headers = set()
+        # Полные перезаписи, ещё не завершённые в фоне: пока основа файла не
+        # записана, дописывать к ней журнал нельзя
+        self.rewrites = 0
+    
+    def attach(self, model):
+        self.detach()
+        self.model = model
+        model.subscribe(self.on_change)
+        self.reset(None)
+    
+    def detach(self):
+        if self.model is not None:
+            self.model.unsubscribe(self.on_change)
+            self.model = None
+    
+    def reset(self, path):
+        self.path = path
+        self.cells.clear()
+        self.headers.clear()
+    
+    def on_change(self, event, col, row, count):
+        if event == "cell":
+            self.cells.add((col, row))
+        elif event == "header":
+            self.headers.add(col)
+        else:
+            self.path = None
+    
+    def can_append(self, path):
+        return self.rewrites == 0 and self.path is not None and self.path == path
+    
+    def take(self):
+        changes = [(LOG_HEADER, col, 0, self.model.header(col)) for col in sorted(self.headers)]
+        changes += [(LOG_CELL, col, row, self.model.value(col, row)) for col, row in sorted(self.cells)]
+        self.cells.clear()
+        self.headers.clear()
+        return changes
+
+def parse_query(text):
+    # "5" или "=5" - точное значение (числа сравниваются как числа), "abc*" - по
+    # началу текста, ">5", "<5", ">=5", "<=5", "5..10" - диапазон чисел
+    # (границы включаются), "*" - любая непустая ячейка
+    text = text.strip()
+    if not text:
+        raise ValueError("Пустой запрос")
+    if text == "*":
+        return ("any",)
+    for op in (">=", "<=", ">", "<"):
+        if text.startswith(op):
+            number = query_number(text[len(op):])
+            if op[0] == ">":
+                return ("range", number, math.inf, op == ">=", False)
+            return ("range", -math.inf, number, False, op == "<=")
+    if ".." in text:
+        low, high = text.split("..", 1)
+        return ("range", query_number(low), query_number(high), True, True)
+    if text.endswith("*"):
+        return ("prefix", text[:-1].strip())
+    if text.startswith("="):
+        text = text[1:].strip()
+    number = parse_number(text)
+    if number == number:
+        return ("range", number, number, True, True)
+    return ("text", text)
+
+def query_number(text):
+    number = parse_number(text)
+    if number != number:
+        raise ValueError(f"Не число: {text.strip()!r}")
+    return number
+
+class ColumnIndex:
+    # Инвертированный индекс одного столбца: текст ячейки -> строки, отсортированные
+    # различные тексты для поиска по началу и отсортированные пары (число, строка)
+    # для диапазонов. Строки в индексе - постоянные идентификаторы, а не номера:
+    # вставка и удаление строк в середине сдвигают только массив uids (номер
+    # строки -> идентификатор), обратное соответствие пересчитывается при
+    # следующем поиске. texts - ссылки на те же строки, что в Column.raw, чтобы
+    # при правке знать, что убрать из индекса.
+    __slots__ = ("texts", "uids", "next_uid", "positions", "rows_by_text", "keys", "numbers")
+    
+    def __init__(self, column):
+        self.build(column)
+    
+    def build(self, column):
+        self.texts = list(column.raw)
+        self.uids = array("q", range(len(self.texts)))
+        self.next_uid = len(self.texts)
+        self.positions = None
+        self.rows_by_text = {}
+        for uid, text in enumerate(self.texts):
+            key = text.strip()
+            if key:
+                self.rows_by_text.setdefault(key, set()).add(uid)
+        self.keys = sorted(self.rows_by_text)
+        self.numbers = sorted((x, uid) for uid, x in enumerate(column.nums) if x == x)
+    
+    def add(self, uid, text):
+        key = text.strip()
+        if key:
+            rows = self.rows_by_text.get(key)
+            if rows is None:
+                rows = self.rows_by_text[key] = set()
+                bisect.insort(self.keys, key)
+            rows.add(uid)
+        number = parse_number(text)
+        if number == number:
+            bisect.insort(self.numbers, (number, uid))
+    
+    def remove(self, uid, text):
+        key = text.strip()
+        if key:
+            rows = self.rows_by_text[key]
+            rows.discard(uid)
+            if not rows:
+                del self.rows_by_text[key]
+                del self.keys[bisect.bisect_left(self.keys, key)]
+        number = parse_number(text)
+        if number == number:
+            del self.numbers[bisect.bisect_left(self.numbers, (number, uid))]
+    
+    def update(self, column, row):
+        text = column.raw[row]
+        uid = self.uids[row]
+        self.remove(uid, self.texts[row])
+        self.texts[row] = text
+        self.add(uid, text)
+    
+    def update_range(self, column, row, count):
+        if count > CACHE_BULK_ROWS:
+            self.build(column)
+            return
+        for i in range(row, row + count):
+            self.update(column, i)
+    
+    def insert(self, column, row, count):
+        uids = array("q", range(self.next_uid, self.next_uid + count))
+        self.next_uid += count
+        self.uids[row:row] = uids
+        texts = column.raw[row:row + count]
+        self.texts[row:row] = texts
+        if row + count < len(self.texts):
+            self.positions = None
+        elif self.positions is not None:
+            self.positions.update(zip(uids, range(row, row + count)))
+        if count <= CACHE_BULK_ROWS:
+            for uid, text in zip(uids, texts):
+                self.add(uid, text)
+            return
+        for uid, text in zip(uids, texts):
+            key = text.strip()
+            if key:
+                self.rows_by_text.setdefault(key, set()).add(uid)
+        self.keys = sorted(self.rows_by_text)
+        self.numbers.extend((x, uid) for uid, x in zip(uids, column.nums[row:row + count]) if x == x)
+        self.numbers.sort()
+    
+    def delete(self, column, row, count):
+        end = row + count
+        uids = self.uids[row:end]
+        texts = self.texts[row:end]
+        del self.uids[row:end]
+        del self.texts[row:end]
+        if row < len(self.texts):
+            self.positions = None
+        elif self.positions is not None:
+            for uid in uids:
+                del self.positions[uid]
+        if count <= CACHE_BULK_ROWS:
+            for uid, text in zip(uids, texts):
+                self.remove(uid, text)
+            return
+        emptied = False
+        for uid, text in zip(uids, texts):
+            key = text.strip()
+            if key:
+                rows = self.rows_by_text[key]
+                rows.discard(uid)
+                if not rows:
+                    del self.rows_by_text[key]
+                    emptied = True
+        if emptied:
+            self.keys = [key for key in self.keys if key in self.rows_by_text]
+        gone = set(uids)
+        self.numbers = [pair for pair in self.numbers if pair[1] not in gone]
+    
+    def row_positions(self):
+        if self.positions is None:
+            self.positions = dict(zip(self.uids, range(len(self.uids))))
+        return self.positions
+    
+    def search(self, query):
+        # Номера строк (в произвольном порядке), где ячейка подходит под запрос
+        return map(self.row_positions().__getitem__, self.search_uids(query))
+    
+    def search_uids(self, query):
+        kind = query[0]
+        if kind == "any":
+            return (uid for uids in self.rows_by_text.values() for uid in uids)
+        if kind == "text":
+            return self.rows_by_text.get(query[1], ())
+        if kind == "prefix":
+            prefix = query[1]
+            keys = self.keys
+            i = bisect.bisect_left(keys, prefix)
+            found = []
+            while i < len(keys) and keys[i].startswith(prefix):
+                found.extend(self.rows_by_text[keys[i]])
+                i += 1
+            return found
+        _, low, high, low_inclusive, high_inclusive = query
+        numbers = self.numbers
+        start = bisect.bisect_left(numbers, (low, -1) if low_inclusive else (low, math.inf))
+        end = bisect.bisect_left(numbers, (high, math.inf) if high_inclusive else (high, -1))
+        return (uid for _, uid in numbers[start:end])
+
+class ColumnCache:
+    # Производные структуры по столбцам (индекс поиска, дерево агрегатов) строятся
+    # при первом обращении и дальше поддерживаются на месте по каждому событию
+    # модели, включая события внутри пакетов; сбрасываются они только при
+    # замене всех данных (load_state). Структура столбца создаётся как
+    # factory(column) и умеет update(column, row), update_range(column, row, count),
+    # insert(column, row, count) и delete(column, row, count).
+    factory = None
+    
+    def __init__(self):
+        self.model = None
+        self.columns = []
+    
+    def attach(self, model):
+        if self.model is not None:
+            self.model.unsubscribe(self.on_change)
+        self.model = model
+        model.subscribe(self.on_change, exact=True)
+        self.columns = [None] * len(model.columns)
+    
+    def column(self, col):
+        cached = self.columns[col]
+        if cached is None:
+            cached = self.columns[col] = self.factory(self.model.columns[col])
+        return cached
+    
+    def on_change(self, event, col, row, count):
+        model = self.model
+        if event == "cell":
+            if self.columns[col] is not None:
+                self.columns[col].update(model.columns[col], row)
+        elif event == "cells":
+            if self.columns[col] is not None:
+                self.columns[col].update_range(model.columns[col], row, count)
+        elif event == "insert_column":
+            self.columns.insert(col, None)
+        elif event == "delete_column":
+            del self.columns[col]
+        elif event == "insert_rows":
+            for cached, column in zip(self.columns, model.columns):
+                if cached is not None:
+                    cached.insert(column, row, count)
+        elif event == "delete_rows":
+            for cached, column in zip(self.columns, model.columns):
+                if cached is not None:
+                    cached.delete(column, row, count)
+        elif event == "reset":
+            self.columns = [None] * len(model.columns)
+
+class TableIndex(ColumnCache):
+    factory = ColumnIndex
+    
+    def query(self, cols, query):
+        # Отсортированные строки, где запрос совпал хотя бы в одном из столбцов cols
+        rows = set()
+        for col in cols:
+            rows.update(self.column(col).search(query))
+        return sorted(rows)
+
+class RangeStats:
+    __slots__ = ("sum", "count", "min", "max")
+    
+    def __init__(self, total=0.0, count=0, low=math.inf, high=-math.inf):
+        self.sum = total
+        self.count = count
+        self.min = low
+        self.max = high
+    
+    def merge(self, other):
+        self.sum += other.sum
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+    
+    @classmethod
+    def of(cls, numbers):
+        numbers = [x for x in numbers if x == x]
+        if not numbers:
+            return cls()
+        return cls(float_sum(numbers), len(numbers), min(numbers), max(numbers))
+    
+    def mean(self):
+        return self.sum / self.count if self.count else NAN
+
+class ColumnAggregate:
+    # Итоги столбца по блокам подряд идущих строк: у каждого блока хранятся
+    # длина, сумма, количество чисел, минимум и максимум. Правка ячейки
+    # пересчитывает один блок; вставка и удаление строк в середине меняют
+    # длину затронутых блоков, а остальные блоки только сдвигаются. Запрос по
+    # диапазону разбирает два крайних блока и складывает итоги целых блоков
+    # между ними встроенными функциями по срезам, без цикла Python по блокам.
+    __slots__ = ("column", "rows", "starts", "lengths", "sums", "counts", "mins", "maxs")
+    
+    def __init__(self, column):
+        self.column = column
+        self.build()
+    
+    def build(self):
+        self.rows = len(self.column.nums)
+        self.lengths = [min(AGGREGATE_BLOCK_ROWS, self.rows - start)
+                        for start in range(0, self.rows, AGGREGATE_BLOCK_ROWS)]
+        self.sums = [0.0] * len(self.lengths)
+        self.counts = [0] * len(self.lengths)
+        self.mins = [math.inf] * len(self.lengths)
+        self.maxs = [-math.inf] * len(self.lengths)
+        self.reindex()
+        for block in range(len(self.lengths)):
+            self.refresh(block)
+    
+    def reindex(self):
+        self.starts = list(accumulate(self.lengths, initial=0))[:-1]
+    
+    def refresh(self, block):
+        start = self.starts[block]
+        stats = RangeStats.of(self.column.nums[start:start + self.lengths[block]])
+        self.sums[block] = stats.sum
+        self.counts[block] = stats.count
+        self.mins[block] = stats.min
+        self.maxs[block] = stats.max
+    
+    def block_of(self, row):
+        return bisect.bisect_right(self.starts, row) - 1
+    
+    def update(self, column, row):
+        self.refresh(self.block_of(row))
+    
+    def update_range(self, column, row, count):
+        for block in range(self.block_of(row), self.block_of(row + count - 1) + 1):
+            self.refresh(block)
+    
+    def insert(self, column, row, count):
+        if not self.lengths:
+            self.build()
+            return
+        block = min(self.block_of(row), len(self.lengths) - 1)
+        self.rows += count
+        length = self.lengths[block] + count
+        if length <= 2 * AGGREGATE_BLOCK_ROWS:
+            self.lengths[block] = length
+            self.reindex()
+            self.refresh(block)
+            return
+        # Переполненный блок делится на блоки обычной длины
+        parts = [min(AGGREGATE_BLOCK_ROWS, length - offset) for offset in range(0, length, AGGREGATE_BLOCK_ROWS)]
+        self.lengths[block:block + 1] = parts
+        for values, neutral in ((self.sums, 0.0), (self.counts, 0), (self.mins, math.inf), (self.maxs, -math.inf)):
+            values[block:block + 1] = [neutral] * len(parts)
+        self.reindex()
+        for i in range(block, block + len(parts)):
+            self.refresh(i)
+    
+    def delete(self, column, row, count):
+        end = row + count
+        first = self.block_of(row)
+        last = self.block_of(end - 1)
+        for block in range(first, last + 1):
+            start = self.starts[block]
+            self.lengths[block] -= min(end, start + self.lengths[block]) - max(row, start)
+        self.rows -= count
+        keep = [block for block in range(first, last + 1) if self.lengths[block]]
+        for values in (self.lengths, self.sums, self.counts, self.mins, self.maxs):
+            values[first:last + 1] = [values[block] for block in keep]
+        if len(self.lengths) > 2 * (self.rows // AGGREGATE_BLOCK_ROWS + 1):
+            # После множества удалений блоки стали мелкими: разбиение заново
+            self.build()
+            return
+        self.reindex()
+        for block in range(first, first + len(keep)):
+            self.refresh(block)
+    
+    def query(self, start, end):
+        # RangeStats строк [start, end); суммы частей складываются через fsum
+        end = min(end, self.rows)
+        if start >= end:
+            return RangeStats()
+        nums = self.column.nums
+        first = self.block_of(start)
+        last = self.block_of(end - 1)
+        if first == last:
+            return RangeStats.of(nums[start:end])
+        head = RangeStats.of(nums[start:self.starts[first + 1]])
+        tail = RangeStats.of(nums[self.starts[last]:end])
+        inner = slice(first + 1, last)
+        return RangeStats(float_sum([head.sum, tail.sum, *self.sums[inner]]),
+                          head.count + tail.count + sum(self.counts[inner]),
+                          min(head.min, tail.min, *self.mins[inner]),
+                          max(head.max, tail.max, *self.maxs[inner]))
+
+class TableAggregates(ColumnCache):
+    factory = ColumnAggregate
+    
+    def query(self, col, start, end):
+        return self.column(col).query(start, end)
+
+def format_stat(stats, key):
+    if key == "count":
+        return str(stats.count)
+    if key == "sum":
+        return f"{stats.sum:.2f}"
+    if not stats.count:
+        return ""
+    value = stats.mean() if key == "mean" else getattr(stats, key)
+    return f"{value:.2f}"
 
 class ScrollableTable(tk.Frame):
-    def __init__(self, parent):
+    # В виртуальном режиме table_inner содержит только видимое окно строк:
+    # владелец таблицы переиспользует одни и те же виджеты, а вертикальная
+    # прокрутка меняет first_row вместо сдвига холста.
+    def __init__(self, parent, virtual=False, overscan=4):
         super().__init__(parent)
         
+        self.virtual = virtual
+        self.overscan = overscan
+        self.row_count = 0
+        self.first_row = 0
+        self.visible_rows = 0
+        self.row_height = 25
+        self.footer_height = 40
+        self.render_rows = None
+        
         self.header_frame = tk.Frame(self)
         self.header_frame.pack(side=tk.TOP, fill=tk.X)
         
@@ -52,6 +1380,77 @@ class ScrollableTable(tk.Frame):
         self.h_scroll.config(command=self.sync_scrollbar)
         
         self._scroll_x = 0
+        
+        if virtual:
+            self.table_canvas.config(yscrollcommand="")
+            self.v_scroll.config(command=self.yview)
+            self.wheel_tag = f"VirtualRows{id(self)}"
+            self.bind_class(self.wheel_tag, "<MouseWheel>", self.on_mousewheel)
+            self.bind_class(self.wheel_tag, "<Button-4>", self.on_mousewheel)
+            self.bind_class(self.wheel_tag, "<Button-5>", self.on_mousewheel)
+            self.add_wheel_tag(self.table_canvas)
+            self.add_wheel_tag(self.table_inner)
+    
+    def add_wheel_tag(self, widget):
+        widget.bindtags((self.wheel_tag,) + widget.bindtags())
+    
+    def fit_rows(self):
+        height = self.table_canvas.winfo_height()
+        if height <= 1:
+            height = self.table_canvas.winfo_reqheight()
+        return max(1, (height - self.footer_height) // max(1, self.row_height))
+    
+    def set_row_count(self, count):
+        self.row_count = count
+        self.refresh_rows()
+    
+    def refresh_rows(self):
+        self.visible_rows = min(self.row_count, self.fit_rows())
+        self.first_row = max(0, min(self.first_row, self.row_count - self.visible_rows))
+        if self.render_rows:
+            self.render_rows(self.first_row, self.visible_rows)
+        self.update_vscroll()
+    
+    def update_vscroll(self):
+        if self.row_count:
+            self.v_scroll.set(self.first_row / self.row_count,
+                              (self.first_row + self.visible_rows) / self.row_count)
+        else:
+            self.v_scroll.set(0, 1)
+    
+    def scroll_to(self, first):
+        first = max(0, min(first, self.row_count - self.visible_rows))
+        if first == self.first_row:
+            return
+        self.first_row = first
+        if self.render_rows:
+            self.render_rows(self.first_row, self.visible_rows)
+        self.update_vscroll()
+    
+    def see_row(self, row):
+        if row < self.first_row:
+            self.scroll_to(row)
+        elif row >= self.first_row + self.visible_rows:
+            self.scroll_to(row - self.visible_rows + 1)
+    
+    def yview(self, *args):
+        if args[0] == "moveto":
+            self.scroll_to(int(round(float(args[1]) * self.row_count)))
+        elif args[0] == "scroll":
+            step = int(args[1])
+            if args[2] == "pages":
+                step *= max(1, self.visible_rows - 1)
+            self.scroll_to(self.first_row + step)
+    
+    def on_mousewheel(self, event):
+        if event.num == 4:
+            step = -3
+        elif event.num == 5:
+            step = 3
+        else:
+            step = -3 if event.delta > 0 else 3
+        self.scroll_to(self.first_row + step)
+        return "break"
     
     def sync_scrollbar(self, *args):
         self.header_canvas.xview(*args)
@@ -73,9 +1472,704 @@ class ScrollableTable(tk.Frame):
     def on_canvas_configure(self, event):
         self.table_canvas.itemconfig(self.table_window, width=event.width)
         self.header_canvas.itemconfig(self.header_window, width=event.width)
+        if self.virtual and min(self.row_count, self.fit_rows()) != self.visible_rows:
+            self.refresh_rows()
+
+class EditScheduler:
+    # Ввод только отмечает ячейку как изменённую: текст читается, суммы
+    # пересчитываются и отображаются один раз за кадр (after), а серия нажатий
+    # в одной ячейке складывается в один шаг отмены после паузы quiet_ms.
+    def __init__(self, app, frame_ms=FRAME_MS, quiet_ms=TYPING_QUIET_MS):
+        self.app = app
+        self.frame_ms = frame_ms
+        self.quiet_ms = quiet_ms
+        # (столбец, строка) -> виджет; строка None означает заголовок
+        self.dirty_cells = {}
+        self.dirty_columns = set()
+        # [столбец, строка, исходный текст, текущий текст] текущей серии ввода
+        self.typing = None
+        self._frame_job = None
+        self._quiet_job = None
+    
+    def pending(self):
+        return {
+            "cells": list(self.dirty_cells),
+            "columns": sorted(self.dirty_columns),
+            "typing": tuple(self.typing) if self.typing else None,
+        }
+    
+    def cell_changed(self, col, row, widget):
+        self.dirty_cells[(col, row)] = widget
+        self.schedule_frame()
+    
+    def column_changed(self, col):
+        self.dirty_columns.add(col)
+        self.schedule_frame()
+    
+    def schedule_frame(self):
+        if self._frame_job is None:
+            self._frame_job = self.app.after(self.frame_ms, self.run_frame)
+    
+    def run_frame(self):
+        self._frame_job = None
+        self.flush_cells()
+        columns, self.dirty_columns = self.dirty_columns, set()
+        for col in sorted(columns):
+            self.app.update_sum(col)
+        if columns:
+            self.app.update_selection_stats()
+    
+    def flush_cells(self):
+        while self.dirty_cells:
+            cells, self.dirty_cells = self.dirty_cells, {}
+            for (col, row), widget in cells.items():
+                self.app.apply_edit(col, row, widget)
+    
+    def typed(self, col, row, old, new):
+        if self.typing and self.typing[:2] == [col, row]:
+            self.typing[3] = new
+        else:
+            self.commit_typing()
+            self.typing = [col, row, old, new]
+        if self._quiet_job is not None:
+            self.app.after_cancel(self._quiet_job)
+        self._quiet_job = self.app.after(self.quiet_ms, self.commit_typing)
+    
+    def commit_typing(self):
+        if self._quiet_job is not None:
+            self.app.after_cancel(self._quiet_job)
+            self._quiet_job = None
+        if not self.typing:
+            return
+        col, row, old, new = self.typing
+        self.typing = None
+        if old == new:
+            return
+        if row is None:
+            self.app.history.record(HeaderEdit(col, old, new))
+        else:
+            self.app.history.record(CellEdit(col, row, old, new))
+    
+    def flush(self):
+        if self._frame_job is not None:
+            self.app.after_cancel(self._frame_job)
+        self.run_frame()
+        self.commit_typing()
+
+class BackgroundWorker:
+    # Задачи (запись, разбор файлов) выполняются в отдельном потоке по очереди;
+    # завершение передаётся в поток Tk опросом через after: callback(future)
+    def __init__(self, widget, name, poll_ms=50):
+        self.widget = widget
+        self.name = name
+        self.poll_ms = poll_ms
+        # Поток создаётся при первой задаче, а не при запуске программы
+        self.executor = None
+        self.pending = []
+        self._poll_job = None
+    
+    def submit(self, func, *args, callback=None):
+        if self.executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=self.name)
+        future = self.executor.submit(func, *args)
+        self.pending.append((future, callback))
+        if self._poll_job is None:
+            self._poll_job = self.widget.after(self.poll_ms, self.poll)
+        return future
+    
+    def busy(self):
+        return bool(self.pending)
+    
+    def poll(self):
+        self._poll_job = None
+        pending, self.pending = self.pending, []
+        for future, callback in pending:
+            if not future.done():
+                self.pending.append((future, callback))
+            elif callback:
+                callback(future)
+        if self.pending and self._poll_job is None:
+            self._poll_job = self.widget.after(self.poll_ms, self.poll)
+    
+    def shutdown(self):
+        # Начатые задачи завершаются до выхода из процесса
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+    
+    def wait(self):
+        # Для тестов и пакетных сценариев: дождаться задач и вызвать обработчики
+        while self.pending:
+            for future, _ in self.pending:
+                future.exception()
+            self.poll()
+
+class LoadJob:
+    # Состояние постепенной загрузки: разбор файла идёт в потоке, затем модель
+    # заполняется частями через after, а прежние модель и история хранятся
+    # до успешного завершения, чтобы отмена вернула всё как было
+    def __init__(self, path, previous, error_title):
+        self.path = path
+        self.previous = previous
+        self.error_title = error_title
+        self.values = None
+        self.loaded = 0
+        self.total = 0
+        self.job = None
+
+def model_memory(model):
+    return sum(200 + text_size(column.raw) + 8 * len(column.nums) for column in model.columns)
+
+class Sheet:
+    # Журнал на вкладке: модель, история отмены, файл и флаги сохранения.
+    # У неактивного листа нет виджетов; вытесненный на диск лист хранит только
+    # путь к копии в кэше (model = None), история остаётся в памяти.
+    next_id = 1
+    
+    def __init__(self, model):
+        # Номер листа различает файлы автосохранения безымянных журналов
+        self.id = Sheet.next_id
+        Sheet.next_id += 1
+        self.model = model
+        self.history = UndoHistory(model)
+        self.changes = ChangeTracker()
+        self.changes.attach(model)
+        self.current_file = None
+        self.unsaved_changes = False
+        self.change_count = 0
+        self.autosaved_count = 0
+        self.recovery_file = None
+        self.tab = None
+        self.spill_path = None
+        self.memory = 0
+        # Вид листа восстанавливается при возврате на вкладку
+        self.first_row = 0
+        self.anchor = None
+        self.row_filter = None
+    
+    def title(self):
+        name = os.path.basename(self.current_file) if self.current_file else "Новый журнал"
+        return f"*{name}" if self.unsaved_changes else name
+
+class SheetCache:
+    # Неактивные листы в порядке давности использования. Когда их модели вместе
+    # занимают больше limit байт (активный лист не считается), самые давние
+    # записываются во временную папку
+    # в компактном формате и читаются обратно при переключении на вкладку.
+    def __init__(self, limit=SHEET_MEMORY_LIMIT):
+        self.limit = limit
+        self.inactive = {}
+        self.memory = 0
+        self.directory = None
+    
+    def deactivate(self, sheet):
+        sheet.memory = model_memory(sheet.model)
+        self.inactive[sheet] = None
+        self.memory += sheet.memory
+        while self.memory > self.limit:
+            self.spill(next(s for s in self.inactive if s.model is not None))
+    
+    def activate(self, sheet):
+        if sheet not in self.inactive:
+            return
+        del self.inactive[sheet]
+        if sheet.model is None:
+            self.restore(sheet)
+        else:
+            self.memory -= sheet.memory
+    
+    def spill(self, sheet):
+        if self.directory is None:
+            import tempfile
+            self.directory = tempfile.mkdtemp(prefix="таблица-учёта-")
+        path = os.path.join(self.directory, f"{id(sheet)}{COLUMNAR_EXT}")
+        write_columnar(sheet.model.to_state(), path)
+        # Журнал правок для дописывания в файл теряет смысл: после возврата
+        # лист сохраняется полной перезаписью
+        sheet.changes.detach()
+        sheet.history.model = None
+        sheet.model = None
+        sheet.spill_path = path
+        self.memory -= sheet.memory
+    
+    def restore(self, sheet):
+        model = read_columnar_model(sheet.spill_path)
+        remove_file(sheet.spill_path)
+        sheet.spill_path = None
+        sheet.model = model
+        sheet.history.model = model
+        sheet.changes.attach(model)
+    
+    def remove(self, sheet):
+        self.inactive.pop(sheet, None)
+        if sheet.spill_path:
+            remove_file(sheet.spill_path)
+            sheet.spill_path = None
+        elif sheet.model is not None and sheet.memory:
+            self.memory -= sheet.memory
+        sheet.memory = 0
+    
+    def close(self):
+        if self.directory:
+            import shutil
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+def sheet_attribute(name):
+    # Свойство JournalApp, которое читает и пишет поле активного листа
+    return property(lambda self: getattr(self.sheet, name),
+                    lambda self, value: setattr(self.sheet, name, value))
+
+def split_patterns(text):
+    # "*.txt; *.csv" -> ["*.txt", "*.csv"]; пустая строка означает все файлы
+    return [part.strip() for part in text.split(";") if part.strip()]
+
+class DirectoryScan:
+    # Обход каталога через os.scandir: тип файла берётся из записи каталога без
+    # отдельного stat на каждый файл. found обновляется по ходу обхода для
+    # индикатора в диалоге, cancel() прерывает обход из потока Tk
+    def __init__(self, directory, recursive=False, patterns=(), full_paths=False):
+        self.directory = directory
+        self.recursive = recursive
+        self.patterns = list(patterns)
+        self.full_paths = full_paths
+        self.found = 0
+        self._cancelled = threading.Event()
+    
+    def cancel(self):
+        self._cancelled.set()
+    
+    def cancelled(self):
+        return self._cancelled.is_set()
+    
+    def matches(self, name):
+        if not self.patterns:
+            return True
+        return any(fnmatch.fnmatch(name, pattern) for pattern in self.patterns)
+    
+    def run(self):
+        names = []
+        pending = deque([self.directory])
+        while pending and not self.cancelled():
+            path = pending.popleft()
+            try:
+                iterator = os.scandir(path)
+            except OSError:
+                # Недоступная вложенная папка пропускается, ошибка самой директории - нет
+                if path == self.directory:
+                    raise
+                continue
+            with iterator:
+                for entry in iterator:
+                    if self.cancelled():
+                        break
+                    try:
+                        if entry.is_file():
+                            if self.matches(entry.name):
+                                names.append(entry.path if self.full_paths else entry.name)
+                                self.found += 1
+                        elif self.recursive and entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                    except OSError:
+                        continue
+        return names
+
+class ImportDialog(tk.Toplevel):
+    # Параметры импорта столбцов из директории; обход идёт в фоновом потоке,
+    # а окно показывает число найденных файлов и позволяет отменить обход
+    def __init__(self, app, directory):
+        super().__init__(app)
+        self.app = app
+        self.directory = directory
+        self.scan = None
+        self._poll_job = None
+        self.title("Импорт из директории")
+        self.transient(app)
+        self.resizable(False, False)
+        
+        self.recursive = tk.BooleanVar(self, value=False)
+        self.patterns = tk.StringVar(self, value="")
+        self.skip_existing = tk.BooleanVar(self, value=True)
+        
+        ttk.Label(self, text=directory).grid(row=0, column=0, columnspan=2, sticky="w", padx=8, pady=(8, 4))
+        ttk.Checkbutton(self, text="Включая вложенные папки", variable=self.recursive).grid(
+            row=1, column=0, columnspan=2, sticky="w", padx=8)
+        ttk.Label(self, text="Маски файлов (через ;):").grid(row=2, column=0, sticky="w", padx=8, pady=4)
+        ttk.Entry(self, textvariable=self.patterns, width=20).grid(row=2, column=1, sticky="we", padx=8, pady=4)
+        ttk.Checkbutton(self, text="Пропускать уже существующие заголовки", variable=self.skip_existing).grid(
+            row=3, column=0, columnspan=2, sticky="w", padx=8)
+        self.status = ttk.Label(self, text="")
+        self.status.grid(row=4, column=0, columnspan=2, sticky="w", padx=8, pady=4)
+        
+        buttons = ttk.Frame(self)
+        buttons.grid(row=5, column=0, columnspan=2, sticky="e", padx=8, pady=(4, 8))
+        self.import_btn = ttk.Button(buttons, text="Импорт", command=self.start)
+        self.import_btn.pack(side="left", padx=(0, 4))
+        ttk.Button(buttons, text="Отмена", command=self.close).pack(side="left")
+        self.protocol("WM_DELETE_WINDOW", self.close)
+    
+    def start(self):
+        self.import_btn.config(state="disabled")
+        self.scan = DirectoryScan(self.directory, self.recursive.get(), split_patterns(self.patterns.get()))
+        self.app.load_worker.submit(self.scan.run, callback=self.on_scanned)
+        self.show_progress()
+    
+    def show_progress(self):
+        self._poll_job = None
+        self.status.config(text=f"Найдено файлов: {self.scan.found}")
+        self._poll_job = self.after(SCAN_POLL_MS, self.show_progress)
+    
+    def on_scanned(self, future):
+        if self.scan.cancelled():
+            return
+        skip_existing = self.skip_existing.get()
+        self.close()
+        try:
+            names = future.result()
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось импортировать из директории:\n{e}")
+            return
+        self.app.import_columns(names, skip_existing)
+    
+    def close(self):
+        if self.scan is not None:
+            self.scan.cancel()
+        if self._poll_job is not None:
+            self.after_cancel(self._poll_job)
+            self._poll_job = None
+        self.destroy()
+
+class SearchBar(ttk.Frame):
+    # Строка поиска над таблицей: переход к следующему совпадению и отбор строк.
+    # Отбор меняет только отображение строк модели на строки сетки.
+    ALL_COLUMNS = "Все столбцы"
+    
+    def __init__(self, app):
+        super().__init__(app)
+        self.app = app
+        self.column_box = ttk.Combobox(self, state="readonly", width=18, postcommand=self.update_columns)
+        self.column_box.pack(side=tk.LEFT, padx=(5, 2), pady=4)
+        self.query_entry = ttk.Entry(self, width=18)
+        self.query_entry.pack(side=tk.LEFT, padx=2, pady=4)
+        self.query_entry.bind("<Return>", lambda e: self.find_next())
+        self.query_entry.bind("<Escape>", lambda e: self.close())
+        ttk.Button(self, text="Найти далее", command=self.find_next).pack(side=tk.LEFT, padx=2)
+        ttk.Button(self, text="Отобрать", command=self.apply_filter).pack(side=tk.LEFT, padx=2)
+        ttk.Button(self, text="Показать все", command=self.clear_filter).pack(side=tk.LEFT, padx=2)
+        ttk.Checkbutton(self, text="Итоги по отобранным", variable=app.filter_subtotals,
+                        command=app.update_all_sums).pack(side=tk.LEFT, padx=2)
+        ttk.Button(self, text="✕", width=3, command=self.close).pack(side=tk.RIGHT, padx=5)
+        self.status = ttk.Label(self, text="")
+        self.status.pack(side=tk.LEFT, padx=5)
+        self.update_columns()
+        self.column_box.current(0)
+    
+    def update_columns(self):
+        current = self.column_box.current() if self.column_box.get() else 0
+        headers = [self.ALL_COLUMNS] + [self.app.model.header(c) for c in range(len(self.app.model.columns))]
+        self.column_box.config(values=headers)
+        self.column_box.current(current if 0 <= current < len(headers) else 0)
+    
+    def selected_columns(self):
+        choice = self.column_box.current()
+        if choice <= 0 or choice > len(self.app.model.columns):
+            return None
+        return [choice - 1]
+    
+    def query(self):
+        try:
+            return parse_query(self.query_entry.get())
+        except ValueError as e:
+            self.status.config(text=str(e))
+            return None
+    
+    def find_next(self):
+        query = self.query()
+        if query is not None:
+            found = self.app.find_next(self.selected_columns(), query)
+            self.status.config(text="" if found else "Не найдено")
+    
+    def apply_filter(self):
+        query = self.query()
+        if query is not None:
+            count = self.app.apply_filter(self.selected_columns(), query)
+            self.status.config(text=f"Отобрано строк: {count}")
+    
+    def clear_filter(self):
+        self.app.clear_filter()
+        self.status.config(text="")
+    
+    def open(self):
+        self.update_columns()
+        self.pack(side=tk.TOP, fill=tk.X, before=self.app.scrollable_table)
+        self.query_entry.focus_set()
+        self.query_entry.select_range(0, tk.END)
+    
+    def close(self):
+        self.clear_filter()
+        self.pack_forget()
+
+class LatencyStats:
+    __slots__ = ("count", "total", "max", "buckets")
+    
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+    
+    def add(self, ms):
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+        i = 0
+        while i < len(LATENCY_BUCKETS_MS) and ms > LATENCY_BUCKETS_MS[i]:
+            i += 1
+        self.buckets[i] += 1
+    
+    def percentile(self, q):
+        # Оценка сверху по гистограмме: граница корзины, но не больше максимума
+        seen = 0
+        for bound, n in zip(LATENCY_BUCKETS_MS + (self.max,), self.buckets):
+            seen += n
+            if seen >= q * self.count:
+                return min(bound, self.max)
+        return self.max
+
+def count_widgets(widget):
+    count = 0
+    stack = [widget]
+    while stack:
+        count += 1
+        stack.extend(stack.pop().winfo_children())
+    return count
+
+class Instrumentation:
+    # Замер задержек обработчиков (включается ключом --profile или переменной
+    # окружения JOURNAL_PROFILE). Методы классов подменяются обёртками до создания
+    # окна, поэтому замеряются и вызовы через привязки событий. Кроме гистограмм
+    # копится трасса в формате Chrome Trace Event (chrome://tracing, Perfetto).
+    HANDLERS = {
+        "JournalApp": ("on_cell_edit", "on_header_edit", "on_cell_focus", "on_model_change", "move_focus",
+                       "render_rows", "layout_rows", "sync_columns", "regrid_columns", "execute",
+                       "undo_action", "redo_action", "update_sum", "update_all_sums", "paste_block",
+                       "add_column", "add_row", "insert_rows", "delete_rows", "delete_columns",
+                       "restore_state", "prepare_save_data", "start_save", "autosave", "on_file_parsed",
+                       "load_chunk", "set_model", "switch_sheet", "import_columns"),
+        "ScrollableTable": ("on_table_configure", "on_canvas_configure", "sync_scrollbar", "sync_scroll_x",
+                            "on_mousewheel", "scroll_to", "refresh_rows", "fit_rows"),
+        "EditScheduler": ("run_frame", "flush_cells", "commit_typing"),
+        "TableModel": ("to_state", "load_state")
+    }
+    # Функции, которые выполняются в фоновых потоках сохранения и загрузки
+    TASKS = ("read_journal_source", "write_journal_file", "append_columnar_log", "write_state_atomic")
+    
+    def __init__(self, trace_path=None):
+        self.trace_path = trace_path
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+        self.app = None
+        self.reset()
+    
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+            self.events = deque(maxlen=PROFILE_TRACE_LIMIT)
+            self.samples = deque(maxlen=PROFILE_TRACE_LIMIT)
+    
+    def install(self):
+        module = globals()
+        for class_name, names in self.HANDLERS.items():
+            cls = module[class_name]
+            for name in names:
+                setattr(cls, name, self.timed(f"{class_name}.{name}", getattr(cls, name)))
+        for name in self.TASKS:
+            module[name] = self.timed(name, module[name])
+    
+    def timed(self, name, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(name, start, time.perf_counter())
+        return wrapper
+    
+    def record(self, name, start, end):
+        ms = (end - start) * 1000
+        with self.lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = LatencyStats()
+            stats.add(ms)
+            self.events.append((name, start, end, threading.get_ident()))
+    
+    def attach(self, app):
+        self.app = app
+        app.after(PROFILE_HEARTBEAT_MS, self.heartbeat, time.perf_counter() + PROFILE_HEARTBEAT_MS / 1000)
+        app.after(PROFILE_SAMPLE_MS, self.sample_loop)
+    
+    def heartbeat(self, expected):
+        # Опоздание таймера - время, когда цикл Tk был занят (в том числе
+        # геометрией и перерисовкой, которые не видны в обработчиках)
+        now = time.perf_counter()
+        if now - expected > FRAME_MS / 1000:
+            self.record("event_loop_lag", expected, now)
+        else:
+            with self.lock:
+                self.stats.setdefault("event_loop_lag", LatencyStats()).add(max(0.0, now - expected) * 1000)
+        self.app.after(PROFILE_HEARTBEAT_MS, self.heartbeat, time.perf_counter() + PROFILE_HEARTBEAT_MS / 1000)
+    
+    def sample(self):
+        app = self.app
+        sample = (time.perf_counter(), count_widgets(app), len(app.history.undo_stack), app.history.memory)
+        with self.lock:
+            self.samples.append(sample)
+        return sample
+    
+    def sample_loop(self):
+        self.sample()
+        self.app.after(PROFILE_SAMPLE_MS, self.sample_loop)
+    
+    def summary(self):
+        with self.lock:
+            items = list(self.stats.items())
+        return sorted(items, key=lambda item: item[1].total, reverse=True)
+    
+    def write_trace(self, path):
+        with self.lock:
+            events = list(self.events)
+            samples = list(self.samples)
+        pid = os.getpid()
+        us = lambda t: round((t - self.origin) * 1e6, 1)
+        trace = [{"name": name, "ph": "X", "ts": us(start), "dur": round((end - start) * 1e6, 1), "pid": pid, "tid": tid}
+                 for name, start, end, tid in events]
+        for t, widgets, records, memory in samples:
+            trace.append({"name": "widgets", "ph": "C", "ts": us(t), "pid": pid, "args": {"widgets": widgets}})
+            trace.append({"name": "undo", "ph": "C", "ts": us(t), "pid": pid,
+                          "args": {"records": records, "bytes": memory}})
+        atomic_write(path, lambda f: json.dump({"traceEvents": trace}, f))
+    
+    def close(self):
+        if self.trace_path:
+            try:
+                self.write_trace(self.trace_path)
+            except OSError:
+                pass
+
+class DiagnosticsWindow(tk.Toplevel):
+    COLUMNS = (("calls", "Вызовов", 70), ("mean", "Среднее, мс", 90), ("p50", "p50, мс", 70),
+               ("p95", "p95, мс", 70), ("max", "Макс., мс", 80), ("total", "Всего, мс", 90))
+    
+    def __init__(self, app, instrumentation):
+        super().__init__(app)
+        self.instrumentation = instrumentation
+        self._refresh_job = None
+        self.title("Диагностика")
+        self.geometry("720x420")
+
+        self.tree = ttk.Treeview(self, columns=[name for name, _, _ in self.COLUMNS])
+        self.tree.heading("#0", text="Обработчик")
+        self.tree.column("#0", width=240)
+        for name, title, width in self.COLUMNS:
+            self.tree.heading(name, text=title)
+            self.tree.column(name, width=width, anchor="e")
+        scroll = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.config(yscrollcommand=scroll.set)
+        
+        self.status = ttk.Label(self, text="")
+        buttons = ttk.Frame(self)
+        ttk.Button(buttons, text="Сбросить", command=self.reset).pack(side=tk.LEFT, padx=(0, 4))
+        ttk.Button(buttons, text="Сохранить трассу...", command=self.export_trace).pack(side=tk.LEFT, padx=(0, 4))
+        ttk.Button(buttons, text="Закрыть", command=self.close).pack(side=tk.LEFT)
+        
+        buttons.pack(side=tk.BOTTOM, anchor="e", padx=8, pady=8)
+        self.status.pack(side=tk.BOTTOM, anchor="w", padx=8)
+        scroll.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.pack(fill=tk.BOTH, expand=True)
+        self.protocol("WM_DELETE_WINDOW", self.close)
+        self.refresh()
+    
+    def refresh(self):
+        self._refresh_job = None
+        self.tree.delete(*self.tree.get_children())
+        for name, stats in self.instrumentation.summary():
+            self.tree.insert("", tk.END, text=name, values=(
+                stats.count, f"{stats.total / stats.count:.2f}", f"{stats.percentile(0.5):.2f}",
+                f"{stats.percentile(0.95):.2f}", f"{stats.max:.2f}", f"{stats.total:.0f}"))
+        _, widgets, records, memory = self.instrumentation.sample()
+        self.status.config(text=f"Виджетов: {widgets}    История отмены: {records} записей, "
+                                f"{memory / 1024 / 1024:.1f} МиБ")
+        self._refresh_job = self.after(PROFILE_SAMPLE_MS, self.refresh)
+    
+    def reset(self):
+        self.instrumentation.reset()
+        self.refresh_now()
+    
+    def refresh_now(self):
+        if self._refresh_job is not None:
+            self.after_cancel(self._refresh_job)
+        self.refresh()
+    
+    def export_trace(self):
+        filepath = filedialog.asksaveasfilename(parent=self, defaultextension=".json",
+                                                initialfile="trace.json", filetypes=[("Трасса", "*.json")])
+        if not filepath:
+            return
+        try:
+            self.instrumentation.write_trace(filepath)
+        except OSError as e:
+            messagebox.showerror("Ошибка", f"Не удалось сохранить трассу:\n{e}", parent=self)
+    
+    def close(self):
+        if self._refresh_job is not None:
+            self.after_cancel(self._refresh_job)
+            self._refresh_job = None
+        self.destroy()
+
+class StartupTimer:
+    # Замер холодного старта (--startup-time[=файл.jsonl]): секунды от начала
+    # выполнения модуля до создания окна, его показа и готовности к работе.
+    # Время запуска интерпретатора и распаковки exe сюда не входит.
+    def __init__(self, path=None, exit_when_ready=True):
+        self.path = path
+        self.exit_when_ready = exit_when_ready
+        self.shown = False
+        self.marks = []
+        self.mark("импорт")
+    
+    def mark(self, name):
+        self.marks.append((name, time.perf_counter() - STARTUP_T0))
+    
+    def report(self, filepath, rows, columns):
+        print("  ".join(f"{name}: {t * 1000:.0f} мс" for name, t in self.marks), file=sys.stderr)
+        if not self.path:
+            return
+        record = {
+            "file": filepath,
+            "rows": rows,
+            "columns": columns,
+            "marks_ms": {name: round(t * 1000, 1) for name, t in self.marks}
+        }
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"Не удалось записать замер: {e}", file=sys.stderr)
 
 class JournalApp(tk.Tk):
-    def __init__(self, init_file=None):
+    model = sheet_attribute("model")
+    history = sheet_attribute("history")
+    changes = sheet_attribute("changes")
+    current_file = sheet_attribute("current_file")
+    unsaved_changes = sheet_attribute("unsaved_changes")
+    change_count = sheet_attribute("change_count")
+    autosaved_count = sheet_attribute("autosaved_count")
+    recovery_file = sheet_attribute("recovery_file")
+    
+    def __init__(self, init_file=None, autosave_interval=AUTOSAVE_INTERVAL_MS, instrumentation=None,
+                 sheet_memory_limit=SHEET_MEMORY_LIMIT, startup=None, recovery_dir=RECOVERY_DIR):
         super().__init__()
         self.title("Таблица учёта продукции на уголковой линии")
         self.geometry("450x220")
@@ -86,79 +2180,189 @@ class JournalApp(tk.Tk):
         except Exception:
             pass
         
-        self.data_rows = 1
+        # Журналы на вкладках; сетка виджетов одна и показывает активный лист.
+        # Если файл задан при запуске, сетка по умолчанию не строится: столбцы
+        # появятся сразу из файла
+        if init_file and os.path.isfile(init_file):
+            self.sheet = Sheet(TableModel(columns=0, rows=0))
+        else:
+            init_file = None
+            self.sheet = Sheet(TableModel())
+        self.sheets = [self.sheet]
+        self.sheet_cache = SheetCache(sheet_memory_limit)
+        # Индекс подписывается раньше представления, чтобы отбор строк
+        # пересчитывался уже по обновлённому индексу
+        self.index = TableIndex()
+        self.index.attach(self.model)
+        self.aggregates = TableAggregates()
+        self.aggregates.attach(self.model)
+        self.model.subscribe(self.on_model_change)
+        self.scheduler = EditScheduler(self)
+        
+        # Для каждого столбца: [кнопка удаления, заголовок, ячейка суммы]
         self.columns = []
+        # Включённые строки итогов: (статистика, подпись, [ячейка на каждый столбец])
+        self.summary_rows = []
+        self.summary_vars = {key: tk.BooleanVar(self, value=False) for key, _ in SUMMARY_STATS}
+        # Виджеты ячеек есть только у видимых строк и переиспользуются при прокрутке
+        self.row_slots = []
+        self.del_row_buttons = []
+        self._cell_pos = {}
+        self._shown_text = {}
+        self._shown_style = {}
+        self._layout = None
+        # Выделение хранится в координатах модели: (столбец, строка) якоря
+        # и прямоугольник (столбец1, строка1, столбец2, строка2)
+        self.anchor = None
+        self.selection = None
+        # Отбор строк: row_map - отсортированные строки модели, которые показываются
+        # (None - показываются все), row_filter - (столбцы, запрос) для пересчёта
+        self.row_map = None
+        self.row_filter = None
+        self.filter_subtotals = tk.BooleanVar(self, value=False)
+        self.search_bar = None
+        ttk.Style(self).configure("Selected.TEntry", fieldbackground="#cde6ff", foreground="#00306e")
         
-        self.undo_stack = []
-        self.redo_stack = []
-        self.max_undo = 50
+        self.save_worker = BackgroundWorker(self, "journal-save")
+        self.load_worker = BackgroundWorker(self, "journal-load")
+        self.loader = None
+        self.autosave_interval = autosave_interval
+        self._close_skipped = set()
+        self.instrumentation = instrumentation
+        self.diagnostics = None
+        self.startup = startup
+        self.recovery_session = RecoverySession(recovery_dir)
         
-        self.current_file = None
-        self.unsaved_changes = False
+        top_frame = ttk.Frame(self)
+        top_frame.pack(side=tk.TOP, fill=tk.X)
         
-        # Меню
-        menubar = tk.Menu(self)
+        self.add_col_btn = ttk.Button(top_frame, text="Добавить столбец", command=self.add_column)
+        self.add_col_btn.pack(side=tk.LEFT, padx=5, pady=6)
+        
+        self.quick_save_btn = ttk.Button(top_frame, text="Быстрое сохранение", command=self.quick_save)
+        self.quick_save_btn.pack(side=tk.LEFT, padx=5, pady=6)
+        
+        # Индикатор загрузки показывается только во время открытия файла
+        self.load_progress = ttk.Progressbar(top_frame, length=150, mode="determinate")
+        self.load_cancel_btn = ttk.Button(top_frame, text="Отмена", command=self.cancel_load)
+        
+        # Полоса вкладок показывается, когда открыто больше одного журнала;
+        # страницы пустые, таблица под полосой общая
+        self.tabs = ttk.Notebook(self)
+        self.tabs.bind("<<NotebookTabChanged>>", self.on_tab_changed)
+        self.add_tab(self.sheet)
+        
+        # Статистика выделенного диапазона (или столбца текущей ячейки)
+        self.status_bar = ttk.Label(self, text="", anchor="w")
+        self.status_bar.pack(side=tk.BOTTOM, fill=tk.X, padx=5, pady=(0, 2))
+        
+        self.scrollable_table = ScrollableTable(self, virtual=True)
+        self.scrollable_table.pack(fill=tk.BOTH, expand=True)
+        self.scrollable_table.render_rows = self.render_rows
+        
+        self.add_row_btn = ttk.Button(self.scrollable_table.table_inner, text="Добавить строку", width=16, command=self.add_row)
+        self.scrollable_table.add_wheel_tag(self.add_row_btn)
+        
+        self.sync_columns()
+        self.measure_rows()
+        self.refresh_rows()
         
+        self.bind_all("<Control-z>", lambda e: self.undo_action())
+        self.bind_all("<Control-y>", lambda e: self.redo_action())
+        self.bind_all("<Control-f>", lambda e: self.show_search())
+        self.bind_all("<Control-t>", lambda e: self.new_sheet())
+        self.bind_all("<Control-w>", lambda e: self.close_sheet())
+        
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        
+        if init_file:
+            self.open_file(init_file, "Не удалось загрузить файл при запуске")
+        else:
+            self.after_idle(self.check_recovery)
+        self.schedule_autosave()
+        if instrumentation:
+            instrumentation.attach(self)
+        if startup:
+            startup.mark("окно создано")
+        self.bind("<Map>", self.on_first_map)
+    
+    def build_menus(self):
+        menubar = tk.Menu(self)
         filemenu = tk.Menu(menubar, tearoff=0)
         filemenu.add_command(label="Сохранить как...", command=self.save_to_file)
         filemenu.add_command(label="Открыть файл", command=self.load_from_file)
+        filemenu.add_separator()
+        filemenu.add_command(label="Новая вкладка", accelerator="Ctrl+T", command=self.new_sheet)
+        filemenu.add_command(label="Открыть в новой вкладке...", command=self.open_in_new_sheet)
+        filemenu.add_command(label="Закрыть вкладку", accelerator="Ctrl+W", command=self.close_sheet)
         menubar.add_cascade(label="Файл", menu=filemenu)
         
         editmenu = tk.Menu(menubar, tearoff=0)
         editmenu.add_command(label="Отменить", command=self.undo_action)
         editmenu.add_command(label="Вернуть", command=self.redo_action)
+        editmenu.add_separator()
+        editmenu.add_command(label="Вставить строки...", command=self.ask_insert_rows)
+        editmenu.add_command(label="Удалить выделенные строки", command=self.delete_selected_rows)
+        editmenu.add_command(label="Удалить выделенные столбцы", command=self.delete_selected_columns)
+        editmenu.add_separator()
+        editmenu.add_command(label="Найти...", accelerator="Ctrl+F", command=self.show_search)
         menubar.add_cascade(label="Правка", menu=editmenu)
         
-        name_menu = tk.Menu(menubar, tearoff=0)
-        name_menu.add_command(label="Импортировать из директории", command=self.import_columns_from_directory)
-        menubar.add_cascade(label="Маркировки", menu=name_menu)
-        
-        # Новое меню "О программе"
-        about_menu = tk.Menu(menubar, tearoff=0)
-        about_menu.add_command(label="Сведения", command=self.show_about_info)
-        menubar.add_cascade(label="О программе", menu=about_menu)
-        
-        self.config(menu=menubar)
-        
-        top_frame = ttk.Frame(self)
-        top_frame.pack(side=tk.TOP, fill=tk.X)
+        summary_menu = tk.Menu(menubar, tearoff=0)
+        for key, title in SUMMARY_STATS:
+            summary_menu.add_checkbutton(label=f"Строка «{title}»", variable=self.summary_vars[key],
+                                         command=self.sync_summary_rows)
+        menubar.add_cascade(label="Итоги", menu=summary_menu)
         
-        self.add_col_btn = ttk.Button(top_frame, text="Добавить столбец", command=self.add_column)
-        self.add_col_btn.pack(side=tk.LEFT, padx=5, pady=6)
-        
-        self.quick_save_btn = ttk.Button(top_frame, text="Быстрое сохранение", command=self.quick_save)
-        self.quick_save_btn.pack(side=tk.LEFT, padx=5, pady=6)
-        
-        self.scrollable_table = ScrollableTable(self)
-        self.scrollable_table.pack(fill=tk.BOTH, expand=True)
-        
-        self.del_row_buttons = []
-        self.add_row_btn = None
-        
-        for _ in range(3):
-            self.add_column(init=True)
-        self.refresh_delete_row_buttons()
+        name_menu = tk.Menu(menubar, tearoff=0)
+        name_menu.add_command(label="Импортировать из директории", command=self.import_columns_from_directory)
+        menubar.add_cascade(label="Маркировки", menu=name_menu)
         
-        self.bind_all("<Control-z>", lambda e: self.undo_action())
-        self.bind_all("<Control-y>", lambda e: self.redo_action())
+        # Новое меню "О программе"
+        about_menu = tk.Menu(menubar, tearoff=0)
+        about_menu.add_command(label="Сведения", command=self.show_about_info)
+        menubar.add_cascade(label="О программе", menu=about_menu)
         
-        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        if self.instrumentation:
+            diag_menu = tk.Menu(menubar, tearoff=0)
+            diag_menu.add_command(label="Задержки обработчиков", command=self.show_diagnostics)
+            menubar.add_cascade(label="Диагностика", menu=diag_menu)
         
-        if init_file:
-            if os.path.isfile(init_file):
-                try:
-                    with open(init_file, "r", encoding="utf-8") as f:
-                        data = json.load(f)
-                    self.restore_state(data)
-                    self.undo_stack.clear()
-                    self.redo_stack.clear()
-                    self.save_state()
-                    self.current_file = init_file
-                    self.unsaved_changes = False
-                except Exception as e:
-                    messagebox.showerror("Ошибка", f"Не удалось загрузить файл при запуске:\n{e}")
-        
-        self.save_state()
+        self.config(menu=menubar)
+    
+    def on_first_map(self, event):
+        if event.widget is not self:
+            return
+        self.unbind("<Map>")
+        # Отложенная перерисовка выполняется сразу: меню строится, когда окно
+        # с таблицей уже нарисовано
+        self.update_idletasks()
+        if self.startup:
+            self.startup.mark("окно показано")
+            self.startup.shown = True
+        self.build_menus()
+        if self.startup and self.loader is None:
+            self.startup_ready()
+    
+    def startup_ready(self):
+        # Готовность к работе: окно показано и файл из командной строки загружен
+        startup, self.startup = self.startup, None
+        if startup is None:
+            return
+        startup.mark("готово")
+        startup.report(self.current_file, self.data_rows, len(self.model.columns))
+        if startup.exit_when_ready:
+            self.after_idle(self.close_now)
+    
+    @property
+    def data_rows(self):
+        return self.model.data_rows
+    
+    def show_diagnostics(self):
+        if self.diagnostics is not None and self.diagnostics.winfo_exists():
+            self.diagnostics.lift()
+            return
+        self.diagnostics = DiagnosticsWindow(self, self.instrumentation)
     
     def show_about_info(self):
         about_text = (
@@ -172,326 +2376,1246 @@ class JournalApp(tk.Tk):
         messagebox.showinfo("Сведения о программе", about_text)
     
     def mark_changes(self, event=None):
-        self.unsaved_changes = True
+        if not self.unsaved_changes:
+            self.unsaved_changes = True
+            self.update_tab(self.sheet)
+        self.change_count += 1
     
-    def add_column(self, init=False):
-        col_index = len(self.columns)
-        col_entries = []
-        
-        del_col_btn = ttk.Button(self.scrollable_table.header_inner, text="Удалить", width=12,
-                                 command=lambda c=col_index: self.delete_column(c))
-        del_col_btn.grid(row=0, column=col_index, padx=3, pady=3)
+    def on_model_change(self, event, col, row, count):
+        if event == "cell":
+            self.refresh_cell(col, row)
+            self.scheduler.column_changed(col)
+        elif event == "header":
+            self.set_entry_text(self.columns[col][1], self.model.header(col))
+        elif event == "insert_column":
+            self.create_column_widgets(col)
+            self.refresh_rows()
+            self.update_sum(col)
+        elif event == "delete_column":
+            self.destroy_column_widgets(col)
+            self.refresh_rows()
+        elif event in ("insert_rows", "delete_rows"):
+            self.remap_rows(event, row, count)
+            self.refresh_rows()
+            self.update_all_sums()
+        elif event == "reset":
+            if self.row_filter is not None:
+                self.refilter()
+            self.sync_columns()
+    
+    def create_cell(self):
+        entry = ttk.Entry(self.scrollable_table.table_inner, justify='center', width=13)
+        entry.bind("<KeyRelease>", lambda e: self.on_cell_edit(e.widget))
+        entry.bind("<Down>", lambda e: self.move_focus(e.widget, 1))
+        entry.bind("<Return>", lambda e: self.move_focus(e.widget, 1))
+        entry.bind("<Up>", lambda e: self.move_focus(e.widget, -1))
+        entry.bind("<FocusIn>", lambda e: self.on_cell_focus(e.widget))
+        entry.bind("<Button-1>", lambda e: self.set_selection(None))
+        entry.bind("<Shift-Button-1>", lambda e: self.extend_selection(e.widget))
+        self._bind_ctrl_v(entry)
+        self.scrollable_table.add_wheel_tag(entry)
+        self._shown_text[entry] = ""
+        return entry
+    
+    def create_row_slot(self):
+        slot = len(self.row_slots)
+        self.row_slots.append([self.create_cell() for _ in self.columns])
+        btn = ttk.Button(self.scrollable_table.table_inner, text="Удалить строку", width=16,
+                         command=lambda s=slot: self.delete_row(self.model_row(self.scrollable_table.first_row + s)))
+        self.scrollable_table.add_wheel_tag(btn)
+        self.del_row_buttons.append(btn)
+    
+    def create_column_widgets(self, col_index):
+        del_col_btn = ttk.Button(self.scrollable_table.header_inner, text="Удалить", width=12)
         
         header = ttk.Entry(self.scrollable_table.header_inner, justify='center', width=13)
-        header.insert(0, f"Столбец {col_index+1}")
-        header.grid(row=1, column=col_index, padx=3, pady=3)
-        header.bind("<KeyRelease>", lambda e: [self.mark_changes(), self.save_state()])
+        header.bind("<KeyRelease>", lambda e: self.on_header_edit(e.widget))
         self._bind_ctrl_v(header)
         
-        col_entries.append(del_col_btn)
-        col_entries.append(header)
-        
-        for row in range(self.data_rows):
-            entry = ttk.Entry(self.scrollable_table.table_inner, justify='center', width=13)
-            entry.grid(row=row, column=col_index, padx=3, pady=1)
-            entry.bind("<KeyRelease>", lambda e, c=col_index: [self.update_sum(c), self.mark_changes(), self.save_state()])
-            self._bind_ctrl_v(entry)
-            col_entries.append(entry)
-        
         sum_entry = ttk.Entry(self.scrollable_table.table_inner, justify='center', width=13, state='readonly')
-        sum_entry.grid(row=self.data_rows, column=col_index, padx=3, pady=1)
-        col_entries.append(sum_entry)
-        
-        self.columns.append(col_entries)
+        self.scrollable_table.add_wheel_tag(sum_entry)
         
-        if not init:
-            self.refresh_delete_row_buttons()
-            self.update_all_sums()
-            self.save_state()
+        self.columns.insert(col_index, [del_col_btn, header, sum_entry])
+        for slot_entries in self.row_slots:
+            slot_entries.insert(col_index, self.create_cell())
+        for _, _, entries in self.summary_rows:
+            entries.insert(col_index, self.create_summary_entry())
+        self.set_entry_text(header, self.model.header(col_index))
+        self.regrid_columns(col_index)
     
-    def add_row(self):
-        self.data_rows += 1
-        row_index = self.data_rows - 1
-        
-        for col_index, col_entries in enumerate(self.columns):
-            sum_entry = col_entries[-1]
-            sum_entry.grid_forget()
-            sum_entry.grid(row=self.data_rows, column=col_index, padx=3, pady=1)
-            
-            new_entry = ttk.Entry(self.scrollable_table.table_inner, justify='center', width=13)
-            new_entry.grid(row=row_index, column=col_index, padx=3, pady=1)
-            new_entry.bind("<KeyRelease>", lambda e, c=col_index: [self.update_sum(c), self.mark_changes(), self.save_state()])
-            self._bind_ctrl_v(new_entry)
-            col_entries.insert(-1, new_entry)
-        
-        self.refresh_delete_row_buttons()
+    def destroy_column_widgets(self, col_index):
+        for widget in self.columns.pop(col_index):
+            self.destroy_widget(widget)
+        for slot_entries in self.row_slots:
+            self.destroy_widget(slot_entries.pop(col_index))
+        for _, _, entries in self.summary_rows:
+            self.destroy_widget(entries.pop(col_index))
+        self.regrid_columns(col_index)
+    
+    def create_summary_entry(self):
+        entry = ttk.Entry(self.scrollable_table.table_inner, justify='center', width=13, state='readonly')
+        self.scrollable_table.add_wheel_tag(entry)
+        return entry
+    
+    def sync_summary_rows(self):
+        # Строки итогов пересоздаются целиком: их немного и включаются они редко
+        for _, label, entries in self.summary_rows:
+            self.destroy_widget(label)
+            for entry in entries:
+                self.destroy_widget(entry)
+        self.summary_rows = []
+        for key, title in SUMMARY_STATS:
+            if self.summary_vars[key].get():
+                label = ttk.Label(self.scrollable_table.table_inner, text=title)
+                self.scrollable_table.add_wheel_tag(label)
+                self.summary_rows.append((key, label, [self.create_summary_entry() for _ in self.columns]))
+        self.measure_rows()
+        self._layout = None
+        self.refresh_rows()
         self.update_all_sums()
-        self.save_state()
     
-    def delete_column(self, col_index):
-        if len(self.columns) <= 1:
-            messagebox.showwarning("Предупреждение", "Нельзя удалить последний столбец!")
-            return
-        
-        col_entries = self.columns.pop(col_index)
-        for widget in col_entries:
-            widget.grid_forget()
-            widget.destroy()
-        
-        for c in range(col_index, len(self.columns)):
+    def regrid_columns(self, start):
+        for c in range(start, len(self.columns)):
             col_entries = self.columns[c]
             col_entries[0].config(command=lambda c=c: self.delete_column(c))
-            for r, widget in enumerate(col_entries):
-                widget.grid_configure(column=c)
-        
-        self.refresh_delete_row_buttons()
-        self.update_all_sums()
-        self.mark_changes()
-        self.save_state()
+            col_entries[0].grid(row=0, column=c, padx=3, pady=3)
+            col_entries[1].grid(row=1, column=c, padx=3, pady=3)
+        self._layout = None
     
-    def delete_row(self, row_index):
-        if self.data_rows <= 1:
-            messagebox.showwarning("Предупреждение", "Нельзя удалить последнюю строку!")
-            return
-        
-        btn_to_remove = self.del_row_buttons.pop(row_index)
-        btn_to_remove.grid_forget()
-        btn_to_remove.destroy()
-        
-        for col_entries in self.columns:
-            entry_to_remove = col_entries[2 + row_index]
-            entry_to_remove.grid_forget()
-            entry_to_remove.destroy()
-            col_entries.pop(2 + row_index)
-        
-        self.data_rows -= 1
-        
+    def sync_columns(self):
+        # Виджеты добавляются или удаляются только для разницы в числе столбцов,
+        # остальные получают новый текст, если он изменился
+        while len(self.columns) > len(self.model.columns):
+            self.destroy_column_widgets(len(self.columns) - 1)
+        while len(self.columns) < len(self.model.columns):
+            self.create_column_widgets(len(self.columns))
         for col_index, col_entries in enumerate(self.columns):
-            for i in range(self.data_rows):
-                col_entries[2 + i].grid_configure(row=i)
-            col_entries[-1].grid_configure(row=self.data_rows)
-        
+            self.set_entry_text(col_entries[1], self.model.header(col_index))
+        self.refresh_rows()
+        self.update_all_sums()
+    
+    def destroy_widget(self, widget):
+        self._cell_pos.pop(widget, None)
+        self._shown_text.pop(widget, None)
+        self._shown_style.pop(widget, None)
+        widget.grid_forget()
+        widget.destroy()
+    
+    def measure_rows(self):
+        # Высота строки нужна для расчёта числа видимых строк в окне
+        if not self.row_slots:
+            self.create_row_slot()
+        self.update_idletasks()
+        if self.columns:
+            entry_height = self.columns[0][-1].winfo_reqheight()
+        else:
+            # До загрузки файла столбцов нет: высота берётся у пробного поля
+            probe = ttk.Entry(self.scrollable_table.table_inner, width=13)
+            entry_height = probe.winfo_reqheight()
+            probe.destroy()
+        self.scrollable_table.row_height = entry_height + 2
+        self.scrollable_table.footer_height = (max(entry_height + 2, self.add_row_btn.winfo_reqheight() + 12) +
+                                               len(self.summary_rows) * (entry_height + 2))
+    
+    def layout_rows(self, visible):
         col_for_buttons = len(self.columns)
-        for i, btn in enumerate(self.del_row_buttons):
-            btn.config(command=lambda r=i: self.delete_row(r))
-            btn.grid(row=i, column=col_for_buttons, padx=3, pady=1)
+        for slot, slot_entries in enumerate(self.row_slots):
+            btn = self.del_row_buttons[slot]
+            if slot < visible:
+                for c, entry in enumerate(slot_entries):
+                    entry.grid(row=slot, column=c, padx=3, pady=1)
+                    self._cell_pos[entry] = (slot, c)
+                btn.grid(row=slot, column=col_for_buttons, padx=3, pady=1)
+            else:
+                for entry in slot_entries:
+                    entry.grid_remove()
+                btn.grid_remove()
         
-        if self.add_row_btn:
-            self.add_row_btn.grid_forget()
-            self.add_row_btn.grid(row=self.data_rows, column=col_for_buttons, padx=3, pady=6)
+        for c, col_entries in enumerate(self.columns):
+            col_entries[-1].grid(row=visible, column=c, padx=3, pady=1)
+        self.add_row_btn.grid(row=visible, column=col_for_buttons, padx=3, pady=6)
+        for i, (_, label, entries) in enumerate(self.summary_rows, visible + 1):
+            for c, entry in enumerate(entries):
+                entry.grid(row=i, column=c, padx=3, pady=1)
+            label.grid(row=i, column=col_for_buttons, padx=3, pady=1, sticky="w")
+        self._layout = (visible, col_for_buttons)
+    
+    def render_rows(self, first_row, visible):
+        # Несохранённый ввод должен попасть в модель до переиспользования виджетов
+        self.scheduler.flush_cells()
+        if len(self.row_slots) < visible:
+            while len(self.row_slots) < visible + self.scrollable_table.overscan:
+                self.create_row_slot()
+            self._layout = None
+        if self._layout != (visible, len(self.columns)):
+            self.layout_rows(visible)
         
-        self.update_all_sums()
+        for slot in range(visible):
+            row = self.model_row(first_row + slot)
+            for c, entry in enumerate(self.row_slots[slot]):
+                self.set_entry_text(entry, self.model.value(c, row))
+                self.paint_cell(entry, c, row)
+    
+    def paint_cell(self, entry, col_index, row):
+        sel = self.selection
+        selected = sel is not None and sel[0] <= col_index <= sel[2] and sel[1] <= row <= sel[3]
+        style = "Selected.TEntry" if selected else "TEntry"
+        if self._shown_style.get(entry, "TEntry") != style:
+            entry.configure(style=style)
+            self._shown_style[entry] = style
+    
+    def on_cell_focus(self, entry):
+        if entry in self._cell_pos:
+            row, col_index = self.cell_row(entry)
+            # Без выделения в строке состояния итоги столбца - они зависят только от столбца
+            column_changed = self.anchor is None or self.anchor[0] != col_index
+            self.anchor = (col_index, row)
+            if column_changed and not self.selection:
+                self.update_selection_stats()
+    
+    def extend_selection(self, entry):
+        if entry not in self._cell_pos:
+            return "break"
+        row, col_index = self.cell_row(entry)
+        anchor_col, anchor_row = self.anchor or (col_index, row)
+        self.set_selection((min(anchor_col, col_index), min(anchor_row, row),
+                            max(anchor_col, col_index), max(anchor_row, row)))
+        return "break"
+    
+    def set_selection(self, selection):
+        if selection == self.selection:
+            return
+        self.selection = selection
+        first_row = self.scrollable_table.first_row
+        for slot in range(self.scrollable_table.visible_rows):
+            row = self.model_row(first_row + slot)
+            for c, entry in enumerate(self.row_slots[slot]):
+                self.paint_cell(entry, c, row)
+        self.update_selection_stats()
+    
+    def refresh_cell(self, col_index, row):
+        view_row = self.view_row(row)
+        if view_row is None:
+            return
+        slot = view_row - self.scrollable_table.first_row
+        if 0 <= slot < self.scrollable_table.visible_rows:
+            self.set_entry_text(self.row_slots[slot][col_index], self.model.value(col_index, row))
+    
+    def set_entry_text(self, entry, text):
+        if self._shown_text.get(entry) != text:
+            entry.delete(0, tk.END)
+            entry.insert(0, text)
+            self._shown_text[entry] = text
+    
+    def cell_row(self, entry):
+        slot, col_index = self._cell_pos[entry]
+        return self.model_row(self.scrollable_table.first_row + slot), col_index
+    
+    def model_row(self, view_row):
+        return view_row if self.row_map is None else self.row_map[view_row]
+    
+    def view_row(self, row):
+        # Строка сетки для строки модели или None, если строка скрыта отбором
+        if self.row_map is None:
+            return row
+        i = bisect.bisect_left(self.row_map, row)
+        return i if i < len(self.row_map) and self.row_map[i] == row else None
+    
+    def view_row_count(self):
+        return self.data_rows if self.row_map is None else len(self.row_map)
+    
+    def on_cell_edit(self, entry):
+        if entry not in self._cell_pos:
+            return
+        row, col_index = self.cell_row(entry)
+        if self.loader:
+            # Во время загрузки таблица только для просмотра
+            self._shown_text[entry] = None
+            self.refresh_cell(col_index, row)
+            return
+        self.scheduler.cell_changed(col_index, row, entry)
+    
+    def on_header_edit(self, header):
+        for col_index, col_entries in enumerate(self.columns):
+            if col_entries[1] is header:
+                if self.loader:
+                    self._shown_text[header] = None
+                    self.set_entry_text(header, self.model.header(col_index))
+                    return
+                self.scheduler.cell_changed(col_index, None, header)
+                return
+    
+    def apply_edit(self, col_index, row, widget):
+        text = widget.get()
+        self._shown_text[widget] = text
+        if row is None:
+            old = self.model.header(col_index)
+            changed = self.model.set_header(col_index, text)
+        else:
+            old = self.model.value(col_index, row)
+            changed = self.model.set_value(col_index, row, text)
+        if changed:
+            self.scheduler.typed(col_index, row, old, text)
+            self.mark_changes()
+    
+    def execute(self, record):
+        if self.loader:
+            return
+        self.scheduler.flush()
+        self.history.execute(record)
+    
+    def move_focus(self, entry, step):
+        if entry not in self._cell_pos:
+            return
+        row, col_index = self.cell_row(entry)
+        self.focus_cell(self.view_row(row) + step, col_index)
+        return "break"
+    
+    def focus_cell(self, view_row, col_index):
+        if not 0 <= view_row < self.view_row_count():
+            return
+        self.scrollable_table.see_row(view_row)
+        self.row_slots[view_row - self.scrollable_table.first_row][col_index].focus_set()
+    
+    def refresh_rows(self):
+        self.scrollable_table.set_row_count(self.view_row_count())
+    
+    def add_column(self):
+        self.execute(InsertColumn(len(self.model.columns), self.model.new_column()))
+    
+    def add_row(self):
+        self.execute(InsertRows(self.data_rows))
+        self.see_model_row(self.data_rows - 1)
+    
+    def delete_column(self, col_index):
+        self.delete_columns([col_index])
+    
+    def delete_row(self, row_index):
+        self.delete_rows([row_index])
+    
+    def insert_rows(self, row_index, count):
+        self.set_selection(None)
+        self.execute(InsertRows(row_index, count))
+        self.see_model_row(row_index)
         self.mark_changes()
-        self.save_state()
     
-    def refresh_delete_row_buttons(self):
-        for btn in getattr(self, 'del_row_buttons', []):
-            btn.grid_forget()
-            btn.destroy()
-        if self.add_row_btn:
-            self.add_row_btn.grid_forget()
-            self.add_row_btn.destroy()
-            self.add_row_btn = None
-        
-        self.del_row_buttons = []
-        
-        col_for_buttons = len(self.columns)
+    def delete_rows(self, rows):
+        # Диапазоны удаляются с конца, чтобы индексы ещё не удалённых оставались верными
+        ranges = row_ranges(rows)
+        if sum(count for _, count in ranges) >= self.data_rows:
+            messagebox.showwarning("Предупреждение", "Нельзя удалить последнюю строку!")
+            return
         
-        for row in range(self.data_rows):
-            btn = ttk.Button(self.scrollable_table.table_inner, text="Удалить строку", width=16)
-            btn.grid(row=row, column=col_for_buttons, padx=3, pady=1)
-            btn.config(command=lambda r=row: self.delete_row(r))
-            self.del_row_buttons.append(btn)
+        records = [DeleteRows(start, count) for start, count in reversed(ranges)]
+        self.set_selection(None)
+        self.execute(records[0] if len(records) == 1 else Batch(records))
+        self.mark_changes()
+    
+    def delete_columns(self, cols):
+        cols = sorted(set(cols), reverse=True)
+        if len(cols) >= len(self.columns):
+            messagebox.showwarning("Предупреждение", "Нельзя удалить последний столбец!")
+            return
         
-        self.add_row_btn = ttk.Button(self.scrollable_table.table_inner, text="Добавить строку", width=16, command=self.add_row)
-        self.add_row_btn.grid(row=self.data_rows, column=col_for_buttons, padx=3, pady=6)
+        records = [DeleteColumn(c, self.model.columns[c]) for c in cols]
+        self.set_selection(None)
+        self.execute(records[0] if len(records) == 1 else Batch(records))
+        self.mark_changes()
+    
+    def selected_rows(self):
+        if self.selection:
+            first, last = self.selection[1], self.selection[3]
+        elif self.anchor:
+            first = last = self.anchor[1]
+        else:
+            return range(0)
+        if self.row_map is None:
+            return range(first, last + 1)
+        # Скрытые отбором строки внутри выделения не затрагиваются
+        return self.row_map[bisect.bisect_left(self.row_map, first):bisect.bisect_right(self.row_map, last)]
+    
+    def selected_columns(self):
+        if self.selection:
+            return range(self.selection[0], self.selection[2] + 1)
+        if self.anchor:
+            return range(self.anchor[0], self.anchor[0] + 1)
+        return range(0)
+    
+    def delete_selected_rows(self):
+        rows = self.selected_rows()
+        if rows:
+            self.delete_rows(rows)
+    
+    def delete_selected_columns(self):
+        cols = self.selected_columns()
+        if cols:
+            self.delete_columns(cols)
+    
+    def ask_insert_rows(self):
+        count = simpledialog.askinteger("Вставка строк", "Количество строк:", parent=self,
+                                        initialvalue=1, minvalue=1, maxvalue=1000000)
+        if not count:
+            return
+        rows = self.selected_rows()
+        self.insert_rows(rows[0] if rows else self.data_rows, count)
     
     def update_sum(self, col_index):
-        col_entries = self.columns[col_index]
-        total = 0.0
-        for entry in col_entries[2:-1]:
-            val = entry.get().strip()
-            if val:
-                try:
-                    total += float(val)
-                except ValueError:
-                    pass
-        sum_entry = col_entries[-1]
-        sum_entry.config(state='normal')
-        sum_entry.delete(0, tk.END)
-        sum_entry.insert(0, f"{total:.2f}")
-        sum_entry.config(state='readonly')
+        subtotals = self.row_map is not None and self.filter_subtotals.get()
+        if subtotals:
+            text = f"{self.model.subtotal(col_index, self.row_map):.2f}"
+        else:
+            text = f"{self.model.total(col_index):.2f}"
+        self.set_readonly_text(self.columns[col_index][-1], text)
+        if self.summary_rows:
+            stats = self.range_stats(col_index, 0, self.data_rows - 1, subtotals)
+            for key, _, entries in self.summary_rows:
+                self.set_readonly_text(entries[col_index], format_stat(stats, key))
+    
+    def set_readonly_text(self, entry, text):
+        if self._shown_text.get(entry) == text:
+            return
+        entry.config(state='normal')
+        entry.delete(0, tk.END)
+        entry.insert(0, text)
+        entry.config(state='readonly')
+        self._shown_text[entry] = text
     
     def update_all_sums(self):
         for i in range(len(self.columns)):
             self.update_sum(i)
+        self.update_selection_stats()
     
-    def save_state(self):
-        state = {
-            "data_rows": self.data_rows,
-            "columns": []
-        }
-        for col_entries in self.columns:
-            col_data = {
-                "header": col_entries[1].get(),
-                "values": [entry.get() for entry in col_entries[2:-1]]
-            }
-            state["columns"].append(col_data)
-        
-        if self.undo_stack and state == self.undo_stack[-1]:
+    def range_stats(self, col_index, first, last, visible_only=True):
+        # Строки first..last модели; при отборе скрытые строки не учитываются
+        if self.row_map is None or not visible_only:
+            return self.aggregates.query(col_index, first, last + 1)
+        rows = self.row_map[bisect.bisect_left(self.row_map, first):bisect.bisect_right(self.row_map, last)]
+        return RangeStats.of(map(self.model.columns[col_index].nums.__getitem__, rows))
+    
+    def update_selection_stats(self):
+        if self.selection:
+            c1, r1, c2, r2 = self.selection
+            title = "Выделено"
+        elif self.anchor and self.anchor[0] < len(self.model.columns):
+            c1 = c2 = self.anchor[0]
+            r1, r2 = 0, self.data_rows - 1
+            title = f"«{self.model.header(c1)}»"
+        else:
+            self.status_bar.config(text="")
             return
-        
-        self.undo_stack.append(copy.deepcopy(state))
-        if len(self.undo_stack) > self.max_undo:
-            self.undo_stack.pop(0)
-        self.redo_stack.clear()
+        r2 = min(r2, self.data_rows - 1)
+        c2 = min(c2, len(self.model.columns) - 1)
+        stats = RangeStats()
+        for col_index in range(c1, c2 + 1):
+            stats.merge(self.range_stats(col_index, r1, r2))
+        parts = [f"{title}: сумма {format_stat(stats, 'sum')}"]
+        parts += [f"{name.lower()} {format_stat(stats, key)}" for key, name in SUMMARY_STATS]
+        self.status_bar.config(text="   ".join(parts))
     
-    def restore_state(self, state):
-        for col_entries in self.columns:
-            for widget in col_entries:
-                widget.grid_forget()
-                widget.destroy()
-        self.columns.clear()
-        
-        self.data_rows = state.get("data_rows", 1)
-        
-        for col_data in state.get("columns", []):
-            self.add_column()
-            col_index = len(self.columns) - 1
-            self.columns[col_index][1].delete(0, tk.END)
-            self.columns[col_index][1].insert(0, col_data.get("header", f"Столбец {col_index+1}"))
-            
-            values = col_data.get("values", [])
-            while len(values) < self.data_rows:
-                values.append("")
-            while len(values) > self.data_rows:
-                self.add_row()
-            
-            for row_i, val in enumerate(values):
-                entry = self.columns[col_index][2 + row_i]
-                entry.delete(0, tk.END)
-                entry.insert(0, val)
-        
-        self.refresh_delete_row_buttons()
+    def show_search(self):
+        if self.search_bar is None:
+            self.search_bar = SearchBar(self)
+        self.search_bar.open()
+    
+    def filter_columns(self, cols):
+        return range(len(self.model.columns)) if cols is None else cols
+    
+    def find_next(self, cols, query):
+        # Следующее совпадение после текущей ячейки (по строкам, затем по столбцам)
+        self.scheduler.flush()
+        matches = []
+        for col in self.filter_columns(cols):
+            matches.extend((row, col) for row in self.index.query([col], query)
+                           if self.view_row(row) is not None)
+        if not matches:
+            return False
+        matches.sort()
+        col_index, row = self.anchor or (-1, -1)
+        i = bisect.bisect_right(matches, (row, col_index))
+        row, col_index = matches[i % len(matches)]
+        self.set_selection(None)
+        self.anchor = (col_index, row)
+        self.focus_cell(self.view_row(row), col_index)
+        return True
+    
+    def apply_filter(self, cols, query):
+        self.scheduler.flush()
+        # Столбцы запоминаются объектами: номера сдвигаются при вставке и удалении
+        columns = None if cols is None else [self.model.columns[c] for c in cols]
+        self.row_filter = (columns, query)
+        self.refilter()
+        self.scrollable_table.first_row = 0
+        self.refresh_rows()
+        self.update_all_sums()
+        return len(self.row_map)
+    
+    def refilter(self):
+        columns, query = self.row_filter
+        if columns is None:
+            cols = range(len(self.model.columns))
+        else:
+            cols = [c for c, column in enumerate(self.model.columns) if any(column is f for f in columns)]
+            if not cols:
+                # Столбец отбора удалён
+                self.row_filter = self.row_map = None
+                return
+        self.row_map = self.index.query(cols, query)
+    
+    def clear_filter(self):
+        if self.row_filter is None:
+            return
+        self.scheduler.flush()
+        view_row = self.scrollable_table.first_row
+        top = self.model_row(view_row) if view_row < self.view_row_count() else 0
+        self.row_filter = self.row_map = None
+        # Верхняя видимая строка остаётся наверху и без отбора
+        self.scrollable_table.first_row = top
+        self.refresh_rows()
         self.update_all_sums()
     
+    def remap_rows(self, event, row, count):
+        # Вставка и удаление строк сдвигают номера отобранных строк; новые строки
+        # показываются, чтобы добавленную строку было видно и при отборе
+        if self.row_map is None:
+            return
+        if event == "insert_rows":
+            self.row_map = ([r for r in self.row_map if r < row] + list(range(row, row + count)) +
+                            [r + count for r in self.row_map if r >= row])
+        else:
+            self.row_map = [r if r < row else r - count for r in self.row_map if not row <= r < row + count]
+    
+    def restore_state(self, state):
+        self.scheduler.flush()
+        self.model.load_state(state)
+    
     def undo_action(self):
-        if len(self.undo_stack) < 2:
+        if self.loader:
             return
-        current_state = self.undo_stack.pop()
-        self.redo_stack.append(current_state)
-        prev_state = self.undo_stack[-1]
-        self.restore_state(copy.deepcopy(prev_state))
+        self.scheduler.flush()
+        record = self.history.undo()
+        if record:
+            self.show_record(record)
+            self.mark_changes()
     
     def redo_action(self):
-        if not self.redo_stack:
+        if self.loader:
             return
-        state = self.redo_stack.pop()
-        self.undo_stack.append(state)
-        self.restore_state(copy.deepcopy(state))
+        self.scheduler.flush()
+        record = self.history.redo()
+        if record:
+            self.show_record(record)
+            self.mark_changes()
+    
+    def show_record(self, record):
+        # После отмены прокручиваем таблицу к изменённой строке
+        while isinstance(record, Batch) and record.records:
+            record = record.records[0]
+        row = getattr(record, "row", None)
+        if row is not None and row < self.data_rows:
+            self.see_model_row(row)
+    
+    def see_model_row(self, row):
+        view_row = self.view_row(row)
+        if view_row is not None:
+            self.scrollable_table.see_row(view_row)
     
     def prepare_save_data(self):
-        data = {
-            "data_rows": self.data_rows,
-            "columns": []
-        }
-        for col_entries in self.columns:
-            col_data = {
-                "header": col_entries[1].get(),
-                "values": [entry.get() for entry in col_entries[2:-1]]
-            }
-            data["columns"].append(col_data)
-        return data
-    
-    def save_to_file(self):
+        self.scheduler.flush()
+        return self.model.to_state()
+    
+    def save_to_file(self, on_saved=None):
         filepath = filedialog.asksaveasfilename(defaultextension=".json",
-                                                filetypes=[("JSON файлы", "*.json"), ("Все файлы", "*.*")])
+                                                filetypes=[("JSON файлы", "*.json"), ("Компактный журнал", "*.jtb"),
+                                                           ("Все файлы", "*.*")])
         if not filepath:
             return
+        self.start_save(filepath, on_saved)
+    
+    def quick_save(self, on_saved=None):
+        if not self.current_file:
+            self.save_to_file(on_saved)
+            return
+        self.start_save(self.current_file, on_saved)
+    
+    def start_save(self, filepath, on_saved=None):
+        # Снимок модели берётся сразу, запись идёт в фоне; флаг несохранённых
+        # изменений сбрасывается, только если после снимка ничего не менялось
+        if self.loader:
+            return
+        self.scheduler.flush()
+        change_count = self.change_count
+        rewrite = not (self.changes.can_append(filepath) and not self.needs_compaction(filepath))
+        if rewrite:
+            task = (write_journal_file, self.model.to_state(), filepath)
+            self.changes.reset(filepath if is_columnar_path(filepath) else None)
+            self.changes.rewrites += 1
+        else:
+            # В компактный файл дописываются только правки после прошлого сохранения
+            task = (append_columnar_log, filepath, self.changes.take())
+        
+        # К завершению записи пользователь мог перейти на другую вкладку
+        sheet = self.sheet
+        
+        def done(future):
+            if rewrite:
+                sheet.changes.rewrites -= 1
+            error = future.exception()
+            if error:
+                sheet.changes.reset(None)
+                messagebox.showerror("Ошибка", f"Не удалось сохранить файл:\n{error}")
+                return
+            sheet.current_file = filepath
+            if sheet.change_count == change_count:
+                sheet.unsaved_changes = False
+                self.remove_recovery(sheet)
+            self.update_tab(sheet)
+            if on_saved:
+                on_saved()
+        
+        self.save_worker.submit(*task, callback=done)
+    
+    def needs_compaction(self, filepath):
         try:
-            data = self.prepare_save_data()
-            with open(filepath, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=4)
-            self.current_file = filepath
-            self.unsaved_changes = False
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Не удалось сохранить файл:\n{e}")
+            base_end, size = columnar_layout(filepath)
+        except (OSError, ValueError, struct.error):
+            return True
+        return size - base_end > max(COMPACT_MIN_BYTES, base_end // 4)
+    
+    def recovery_path(self, sheet=None):
+        sheet = sheet or self.sheet
+        if sheet.current_file:
+            return sheet.current_file + ".recovery"
+        return self.recovery_session.path(f"лист{sheet.id}")
+    
+    def schedule_autosave(self):
+        if self.autosave_interval:
+            self.after(self.autosave_interval, self.autosave)
+    
+    def autosave(self):
+        self.scheduler.flush()
+        for sheet in self.sheets:
+            self.autosave_sheet(sheet)
+        self.schedule_autosave()
+    
+    def autosave_sheet(self, sheet):
+        # Неактивный лист не меняется, поэтому вытесненный на диск лист
+        # достаточно сохранить при уходе с его вкладки (см. switch_sheet)
+        if not sheet.unsaved_changes or sheet.autosaved_count == sheet.change_count or sheet.model is None:
+            return
+        if self.loader and sheet is self.sheet:
+            return
+        try:
+            path = self.recovery_path(sheet)
+        except OSError:
+            # Папка автосохранений недоступна; попробуем в следующий раз
+            return
+        state = sheet.model.to_state()
+        state["recovery_for"] = sheet.current_file
+        if sheet.recovery_file and sheet.recovery_file != path:
+            self.save_worker.submit(remove_file, sheet.recovery_file)
+        sheet.recovery_file = path
+        sheet.autosaved_count = sheet.change_count
+        self.save_worker.submit(write_state_atomic, state, path,
+                                callback=lambda future: self.on_autosaved(sheet, future))
     
-    def quick_save(self):
+    def on_autosaved(self, sheet, future):
+        if future.exception():
+            # Повторим при следующем срабатывании таймера
+            sheet.autosaved_count = None
+    
+    def remove_recovery(self, sheet=None):
+        # Удаление идёт через тот же поток, чтобы не обогнать запись автосохранения
+        sheet = sheet or self.sheet
+        if sheet.recovery_file:
+            self.save_worker.submit(remove_file, sheet.recovery_file)
+            sheet.recovery_file = None
+            sheet.autosaved_count = sheet.change_count
+    
+    def check_recovery(self):
+        # При замере запуска вопрос о восстановлении остановил бы замер, а
+        # восстановленные данные удалились бы при выходе вместе с файлом
+        if self.startup:
+            return
         if not self.current_file:
-            self.save_to_file()
+            self.check_orphans()
+            return
+        path = self.recovery_path()
+        if not os.path.isfile(path):
             return
+        if os.path.getmtime(path) <= os.path.getmtime(self.current_file):
+            remove_file(path)
+            return
+        if not messagebox.askyesno("Восстановление",
+                                   "Найдены несохранённые изменения после аварийного завершения. Восстановить их?"):
+            remove_file(path)
+            return
+        self.restore_recovery(path)
+    
+    def check_orphans(self):
+        # Безымянные журналы, оставшиеся от аварийно завершённых копий программы;
+        # первый восстанавливается в текущую вкладку, остальные - в новые
+        try:
+            paths = self.recovery_session.adopt_orphans()
+        except OSError as e:
+            messagebox.showerror("Ошибка", f"Не удалось проверить автосохранения:\n{e}")
+            return
+        if not paths:
+            return
+        if not messagebox.askyesno("Восстановление",
+                                   "Найдены несохранённые изменения после аварийного завершения. Восстановить их?"):
+            for path in paths:
+                remove_file(path)
+            return
+        for i, path in enumerate(paths):
+            if i and not self.new_sheet():
+                break
+            self.restore_recovery(path)
+    
+    def restore_recovery(self, path):
         try:
-            data = self.prepare_save_data()
-            with open(self.current_file, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=4)
-            self.unsaved_changes = False
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.restore_state(data)
+            self.history.clear()
+            self.recovery_file = path
+            self.mark_changes()
         except Exception as e:
-            messagebox.showerror("Ошибка", f"Не удалось сохранить файл:\n{e}")
+            messagebox.showerror("Ошибка", f"Не удалось восстановить данные:\n{e}")
     
     def load_from_file(self):
         filepath = filedialog.askopenfilename(defaultextension=".json",
-                                              filetypes=[("JSON файлы", "*.json"), ("Все файлы", "*.*")])
+                                              filetypes=[("Журналы", "*.json *.jtb"), ("JSON файлы", "*.json"),
+                                                         ("Компактный журнал", "*.jtb"), ("Все файлы", "*.*")])
         if not filepath:
             return
-        try:
-            with open(filepath, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            self.restore_state(data)
-            self.undo_stack.clear()
-            self.redo_stack.clear()
-            self.save_state()
-            self.current_file = filepath
-            self.unsaved_changes = False
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Не удалось открыть файл:\n{e}")
+        self.open_file(filepath)
+    
+    def open_file(self, filepath, error_title="Не удалось открыть файл"):
+        if self.loader:
+            self.cancel_load()
+        self.scheduler.flush()
+        loader = LoadJob(filepath, (self.model, self.history), error_title)
+        self.loader = loader
+        self.load_progress.config(mode="indeterminate", value=0)
+        self.load_progress.pack(side=tk.LEFT, padx=5, pady=6)
+        self.load_cancel_btn.pack(side=tk.LEFT, padx=5, pady=6)
+        self.load_progress.start(20)
+        self.load_worker.submit(read_journal_source, filepath,
+                                callback=lambda future: self.on_file_parsed(loader, future))
+    
+    def on_file_parsed(self, loader, future):
+        if loader is not self.loader:
+            return
+        error = future.exception()
+        if error:
+            self.end_load()
+            self.restore_default_grid()
+            messagebox.showerror("Ошибка", f"{loader.error_title}:\n{error}")
+            return
+        result = future.result()
+        if isinstance(result, TableModel):
+            # Компактный журнал: числа не разбираются повторно, а сетка и так
+            # показывает только видимые строки, поэтому модель подключается целиком
+            self.set_model(result, UndoHistory(result))
+            self.finish_load(loader)
+            return
+        data_rows, col_data = result
+        
+        # Новая модель сразу подключается к таблице с заголовками, строки
+        # добавляются частями, начиная с тех, что попадают на первый экран
+        model = TableModel(columns=0, rows=0)
+        model.columns = [Column(header) for header, _ in col_data]
+        loader.values = [values for _, values in col_data]
+        loader.total = data_rows
+        self.set_model(model, UndoHistory(model))
+        self.load_progress.stop()
+        self.load_progress.config(mode="determinate", maximum=max(1, data_rows), value=0)
+        self.load_chunk(loader, self.scrollable_table.fit_rows() + self.scrollable_table.overscan)
+    
+    def load_chunk(self, loader, count):
+        loader.job = None
+        if loader is not self.loader:
+            return
+        start = loader.loaded
+        end = min(loader.total, start + max(1, count))
+        if end > start:
+            try:
+                self.model.insert_rows(start, end - start, [values[start:end] for values in loader.values])
+            except Exception as e:
+                # Иначе загрузка так и осталась бы незавершённой, а таблица - только для чтения
+                self.cancel_load()
+                messagebox.showerror("Ошибка", f"{loader.error_title}:\n{e}")
+                return
+        loader.loaded = end
+        self.load_progress.config(value=end)
+        if end >= loader.total:
+            self.finish_load(loader)
+            return
+        chunk = max(1, LOAD_CHUNK_CELLS // max(1, len(loader.values)))
+        loader.job = self.after(1, self.load_chunk, loader, chunk)
+    
+    def finish_load(self, loader):
+        self.end_load()
+        self.history.clear()
+        self.current_file = loader.path
+        self.unsaved_changes = False
+        self.changes.reset(loader.path if is_columnar_path(loader.path) else None)
+        self.update_tab(self.sheet)
+        self.check_recovery()
+    
+    def cancel_load(self):
+        loader = self.loader
+        if not loader:
+            return
+        if loader.job is not None:
+            self.after_cancel(loader.job)
+        self.end_load()
+        model, history = loader.previous
+        if model is not self.model:
+            self.set_model(model, history)
+        self.restore_default_grid()
+    
+    def end_load(self):
+        self.loader = None
+        self.load_progress.stop()
+        self.load_progress.pack_forget()
+        self.load_cancel_btn.pack_forget()
+        if self.startup and self.startup.shown:
+            self.after_idle(self.startup_ready)
+    
+    def restore_default_grid(self):
+        # При запуске с файлом сетка по умолчанию не строилась; если файл
+        # не открылся, пользователь получает обычную пустую таблицу
+        if not self.model.columns:
+            model = TableModel()
+            self.set_model(model, UndoHistory(model))
+    
+    def set_model(self, model, history):
+        self.scheduler.flush()
+        self.model.unsubscribe(self.on_model_change)
+        self.model = model
+        self.history = history
+        self.changes.attach(model)
+        self.row_filter = None
+        self.anchor = None
+        self.show_model(0)
+    
+    def show_model(self, first_row):
+        # Подключает модель активного листа к общей сетке: виджеты не пересоздаются,
+        # sync_columns добавляет или убирает только разницу в числе столбцов
+        model = self.model
+        self.index.attach(model)
+        self.aggregates.attach(model)
+        model.subscribe(self.on_model_change)
+        self.row_map = None
+        if self.row_filter is not None:
+            self.refilter()
+        self.set_selection(None)
+        self.scrollable_table.first_row = first_row
+        self.sync_columns()
+    
+    def add_tab(self, sheet):
+        sheet.tab = ttk.Frame(self.tabs, height=1)
+        self.tabs.add(sheet.tab, text=sheet.title())
+        if len(self.sheets) > 1:
+            self.tabs.pack(side=tk.TOP, fill=tk.X, before=self.scrollable_table)
+    
+    def update_tab(self, sheet):
+        if sheet.tab is not None:
+            self.tabs.tab(sheet.tab, text=sheet.title())
+    
+    def on_tab_changed(self, event=None):
+        selected = self.tabs.select()
+        for sheet in self.sheets:
+            if str(sheet.tab) == selected:
+                self.switch_sheet(sheet)
+                return
+    
+    def select_sheet(self, sheet):
+        self.switch_sheet(sheet)
+        self.tabs.select(sheet.tab)
+    
+    def switch_sheet(self, sheet):
+        if sheet is self.sheet:
+            return
+        if self.loader:
+            # Во время загрузки лист не меняется: вкладка возвращается на место
+            self.tabs.select(self.sheet.tab)
+            return
+        self.scheduler.flush()
+        old = self.sheet
+        old.first_row = self.scrollable_table.first_row
+        old.anchor = self.anchor
+        old.row_filter = self.row_filter
+        self.model.unsubscribe(self.on_model_change)
+        # Снимок для восстановления берётся до возможного вытеснения листа на диск
+        self.autosave_sheet(old)
+        self.sheet_cache.deactivate(old)
+        self.sheet_cache.activate(sheet)
+        self.sheet = sheet
+        self.anchor = sheet.anchor
+        self.row_filter = sheet.row_filter
+        self.show_model(sheet.first_row)
+    
+    def new_sheet(self):
+        if self.loader:
+            return None
+        sheet = Sheet(TableModel())
+        self.sheets.append(sheet)
+        self.add_tab(sheet)
+        self.select_sheet(sheet)
+        return sheet
+    
+    def open_in_new_sheet(self):
+        filepath = filedialog.askopenfilename(defaultextension=".json",
+                                              filetypes=[("Журналы", "*.json *.jtb"), ("JSON файлы", "*.json"),
+                                                         ("Компактный журнал", "*.jtb"), ("Все файлы", "*.*")])
+        if filepath and self.new_sheet():
+            self.open_file(filepath)
+    
+    def close_sheet(self, sheet=None):
+        sheet = sheet or self.sheet
+        if self.loader:
+            return
+        self.scheduler.flush()
+        if sheet.unsaved_changes:
+            self.select_sheet(sheet)
+            answer = messagebox.askyesnocancel("Сохранение",
+                        f"В журнале «{sheet.title().lstrip('*')}» есть несохранённые изменения. Сохранить перед закрытием?")
+            if answer is True:
+                self.quick_save(on_saved=lambda: self.remove_sheet(sheet))
+                return
+            if answer is None:
+                return
+        self.remove_sheet(sheet)
+    
+    def remove_sheet(self, sheet):
+        if sheet not in self.sheets or self.loader:
+            return
+        if len(self.sheets) == 1:
+            # Последняя вкладка не закрывается, а заменяется пустым журналом
+            self.new_sheet()
+        elif sheet is self.sheet:
+            i = self.sheets.index(sheet)
+            self.select_sheet(self.sheets[i + 1] if i + 1 < len(self.sheets) else self.sheets[i - 1])
+        self.remove_recovery(sheet)
+        self.sheet_cache.remove(sheet)
+        sheet.changes.detach()
+        self.sheets.remove(sheet)
+        self.tabs.forget(sheet.tab)
+        sheet.tab.destroy()
+        if len(self.sheets) == 1:
+            self.tabs.pack_forget()
     
     def import_columns_from_directory(self):
+        if self.loader is not None:
+            return
         directory = filedialog.askdirectory()
         if not directory:
             return
-        try:
-            files = os.listdir(directory)
-            files = [f for f in files if os.path.isfile(os.path.join(directory, f))]
-            if not files:
-                messagebox.showinfo("Импорт из директории", "В выбранной директории нет файлов.")
-                return
-            
-            for file_name in files:
-                self.add_column()
-                col_index = len(self.columns) - 1
-                self.columns[col_index][1].delete(0, tk.END)
-                self.columns[col_index][1].insert(0, file_name)
-            
-            self.mark_changes()
-            self.save_state()
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Не удалось импортировать из директории:\n{e}")
+        ImportDialog(self, directory)
+    
+    def import_columns(self, names, skip_existing=True):
+        # Все столбцы добавляются одной записью истории и одной перестройкой сетки
+        if not names:
+            messagebox.showinfo("Импорт из директории", "В выбранной директории нет файлов.")
+            return 0
+        seen = {column.header for column in self.model.columns} if skip_existing else set()
+        records = []
+        for file_name in names:
+            if skip_existing:
+                if file_name in seen:
+                    continue
+                seen.add(file_name)
+            column = self.model.new_column(file_name)
+            records.append(InsertColumn(len(self.model.columns) + len(records), column))
+        if not records:
+            messagebox.showinfo("Импорт из директории", "Все найденные файлы уже есть в таблице.")
+            return 0
+        self.execute(Batch(records))
+        self.mark_changes()
+        return len(records)
     
     def on_close(self):
-        if self.unsaved_changes:
-            answer = messagebox.askyesnocancel("Сохранение",
-                        "У вас есть несохранённые изменения. Хотите сохранить перед выходом?")
-            if answer is True:
-                self.quick_save()
-                self.destroy()
-            elif answer is False:
-                self.destroy()
+        # Несохранённые листы проверяются по очереди, начиная с текущего;
+        # после успешной записи проверка продолжается со следующего
+        self.scheduler.flush()
+        pending = [sheet for sheet in [self.sheet] + self.sheets
+                   if sheet.unsaved_changes and sheet not in self._close_skipped]
+        if not pending:
+            self.close_now()
+            return
+        sheet = pending[0]
+        self.select_sheet(sheet)
+        if len(self.sheets) > 1:
+            question = f"В журнале «{sheet.title().lstrip('*')}» есть несохранённые изменения. Сохранить перед выходом?"
+        else:
+            question = "У вас есть несохранённые изменения. Хотите сохранить перед выходом?"
+        answer = messagebox.askyesnocancel("Сохранение", question)
+        if answer is True:
+            # Окно закроется, когда фоновая запись успешно завершится
+            self.quick_save(on_saved=self.on_close)
+        elif answer is False:
+            self._close_skipped.add(sheet)
+            self.on_close()
         else:
-            self.destroy()
+            self._close_skipped.clear()
+    
+    def close_now(self):
+        for sheet in self.sheets:
+            self.remove_recovery(sheet)
+        # Блокировка сеанса снимается после удаления его файлов
+        self.save_worker.submit(self.recovery_session.close)
+        self.sheet_cache.close()
+        if self.instrumentation:
+            self.instrumentation.close()
+        self.destroy()
+        self.save_worker.shutdown()
+    
+    def paste_block(self, entry):
+        if entry not in self._cell_pos:
+            return False
+        try:
+            text = self.clipboard_get()
+        except tk.TclError:
+            return False
+        block = parse_clipboard_block(text)
+        if len(block) < 2 and all(len(texts) < 2 for texts in block):
+            # Одна ячейка вставляется в поле обычным образом
+            return False
+        row, col_index = self.cell_row(entry)
+        height = max(len(texts) for texts in block)
+        records = []
+        extra_cols = col_index + len(block) - len(self.model.columns)
+        for i in range(extra_cols):
+            column = self.model.new_column(f"Столбец {len(self.model.columns) + i + 1}")
+            records.append(InsertColumn(len(self.model.columns) + i, column))
+        extra_rows = row + height - self.data_rows
+        if extra_rows > 0:
+            records.append(InsertRows(self.data_rows, extra_rows))
+        records.append(SetBlock(col_index, row, block))
+        self.execute(Batch(records))
+        self.set_selection((col_index, row, col_index + len(block) - 1, row + height - 1))
+        self.mark_changes()
+        return True
     
     def _bind_ctrl_v(self, entry_widget):
         def on_paste(event):
+            if self.paste_block(event.widget):
+                return "break"
             event.widget.event_generate("<<Paste>>")
             return "break"
         entry_widget.bind("<Control-v>", on_paste)
         entry_widget.bind("<Control-V>", on_paste)
 
+# Пакетный подсчёт итогов по многим журналам без интерфейса:
+#   python "таблица учёта.py" --aggregate ПАПКА [-o отчёт.csv|отчёт.json] [--jobs N]
+# Журналы разбираются в пуле процессов, итоги складываются по заголовкам по мере
+# готовности. Итоги каждого файла кэшируются рядом с журналами (ключ - время
+# изменения и размер), так что повторный запуск разбирает только изменённые смены.
+
+def is_journal_state(state):
+    # Рядом с журналами могут лежать другие .json - прежние отчёты (.json с
+    # files/columns[*].total), кэш, настройки. Журнал - это столбцы со значениями.
+    if not isinstance(state, dict) or "errors" in state:
+        return False
+    columns = state.get("columns")
+    return isinstance(columns, list) and all(
+        isinstance(data, dict) and isinstance(data.get("values"), list) for data in columns)
+
+def summarize_journal(path):
+    # [(заголовок, итог)] одного журнала или None, если файл не журнал;
+    # выполняется в процессе пула
+    if is_columnar_file(path):
+        return read_columnar_totals(path)
+    with open(path, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    if not is_journal_state(state):
+        return None
+    _, col_data = TableModel.normalize_state(state)
+    return [(header, ExactSum(x for x in map(parse_number, values) if x == x).value())
+            for header, values in col_data]
+
+def file_signature(path):
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+def load_aggregate_cache(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get("version") != AGGREGATE_CACHE_VERSION:
+        return {}
+    return data.get("files", {})
+
+def save_aggregate_cache(entries, path):
+    data = {"version": AGGREGATE_CACHE_VERSION, "files": entries}
+    atomic_write(path, lambda f: json.dump(data, f, ensure_ascii=False))
+
+class JournalAggregate:
+    # Сводка по заголовкам: итог копится точно, files - в скольких журналах
+    # встречается заголовок. Содержимое журналов здесь не хранится.
+    def __init__(self):
+        self.totals = {}
+        self.files = {}
+        self.processed = 0
+        self.skipped = 0
+        self.errors = []
+    
+    def add(self, totals):
+        if totals is None:
+            self.skipped += 1
+            return
+        self.processed += 1
+        seen = set()
+        for header, total in totals:
+            if header not in self.totals:
+                self.totals[header] = ExactSum()
+                self.files[header] = 0
+            self.totals[header].add(total)
+            if header not in seen:
+                seen.add(header)
+                self.files[header] += 1
+    
+    def rows(self):
+        return [(header, total.value(), self.files[header]) for header, total in self.totals.items()]
+
+def aggregate_journals(paths, cache, jobs=None, progress=None):
+    # Возвращает сводку и записи кэша для всех прочитанных файлов. В пул
+    # одновременно отдаётся не больше AGGREGATE_INFLIGHT файлов на процесс.
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+    aggregate = JournalAggregate()
+    entries = {}
+    
+    def collect(done, pending):
+        for future in done:
+            path, key, signature = pending.pop(future)
+            try:
+                totals = future.result()
+            except Exception as e:
+                aggregate.errors.append((path, str(e)))
+                continue
+            entries[key] = {"signature": signature, "totals": totals}
+            aggregate.add(totals)
+            if progress:
+                progress(path, aggregate)
+    
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        limit = AGGREGATE_INFLIGHT * (jobs or os.cpu_count() or 1)
+        pending = {}
+        for path in paths:
+            key = os.path.abspath(path)
+            try:
+                signature = file_signature(path)
+            except OSError as e:
+                aggregate.errors.append((path, str(e)))
+                continue
+            cached = cache.get(key)
+            if cached is not None and cached.get("signature") == signature:
+                entries[key] = cached
+                aggregate.add(cached["totals"])
+                if progress:
+                    progress(path, aggregate)
+                continue
+            pending[pool.submit(summarize_journal, path)] = (path, key, signature)
+            if len(pending) >= limit:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done, pending)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done, pending)
+    return aggregate, entries
+
+def write_aggregate_report(aggregate, path):
+    if path.lower().endswith(".json"):
+        report = {
+            "files": aggregate.processed,
+            "columns": [{"header": header, "total": total, "files": files}
+                        for header, total, files in aggregate.rows()],
+            "errors": [{"file": file, "error": error} for file, error in aggregate.errors]
+        }
+        atomic_write(path, lambda f: json.dump(report, f, ensure_ascii=False, indent=4))
+        return
+    
+    def writer(f):
+        # BOM и ";" - чтобы Excel открыл отчёт с кириллицей без мастера импорта
+        f.write("\ufeff")
+        out = csv.writer(f, delimiter=";")
+        out.writerow(["Маркировка", "Итог", "Журналов"])
+        for header, total, files in aggregate.rows():
+            out.writerow([header, f"{total:.2f}", files])
+    atomic_write(path, writer, newline="")
+
+def aggregate_main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="таблица учёта",
+        description="Сводные итоги по маркировкам из всех журналов в папке")
+    parser.add_argument("directory", help="папка с журналами (.json, .jtb), обходится рекурсивно")
+    parser.add_argument("-o", "--output", default="итоги.csv", help="файл отчёта: .csv или .json")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="число процессов (по умолчанию - по числу ядер)")
+    parser.add_argument("--cache", default=None, help=f"файл кэша (по умолчанию {AGGREGATE_CACHE} в папке журналов)")
+    parser.add_argument("--no-cache", action="store_true", help="разобрать все журналы заново")
+    args = parser.parse_args(argv)
+    
+    cache_path = args.cache or os.path.join(args.directory, AGGREGATE_CACHE)
+    excluded = {os.path.abspath(cache_path), os.path.abspath(args.output)}
+    scan = DirectoryScan(args.directory, recursive=True, patterns=("*.json", "*" + COLUMNAR_EXT), full_paths=True)
+    try:
+        paths = [path for path in scan.run() if os.path.abspath(path) not in excluded]
+    except OSError as e:
+        print(f"Не удалось прочитать папку: {e}", file=sys.stderr)
+        return 1
+    cache = {} if args.no_cache else load_aggregate_cache(cache_path)
+    
+    def progress(path, aggregate):
+        print(f"\r{aggregate.processed + aggregate.skipped}/{len(paths)}", end="", file=sys.stderr, flush=True)
+    
+    aggregate, entries = aggregate_journals(paths, cache, args.jobs, progress)
+    if paths:
+        print(file=sys.stderr)
+    for path, error in aggregate.errors:
+        print(f"Пропущен {path}: {error}", file=sys.stderr)
+    try:
+        write_aggregate_report(aggregate, args.output)
+        if not args.no_cache:
+            save_aggregate_cache(entries, cache_path)
+    except OSError as e:
+        print(f"Не удалось записать отчёт: {e}", file=sys.stderr)
+        return 1
+    skipped = f", пропущено не журналов: {aggregate.skipped}" if aggregate.skipped else ""
+    print(f"Журналов: {aggregate.processed}, маркировок: {len(aggregate.totals)}{skipped} -> {args.output}")
+    return 1 if aggregate.errors else 0
+
 if __name__ == "__main__":
+    if getattr(sys, "frozen", False):
+        # Дочерние процессы пула в собранном exe
+        import multiprocessing
+        multiprocessing.freeze_support()
+    if len(sys.argv) > 1 and sys.argv[1] == "--aggregate":
+        sys.exit(aggregate_main(sys.argv[2:]))
+    # --profile или --profile=trace.json (трасса записывается при выходе);
+    # --sheet-memory=МБ - сколько памяти могут занимать неактивные вкладки;
+    # --startup-time[=файл.jsonl] - замерить запуск и выйти
+    profile = os.environ.get(PROFILE_ENV)
+    sheet_memory_limit = SHEET_MEMORY_LIMIT
+    startup = None
     init_file = None
-    if len(sys.argv) > 1:
-        arg = sys.argv[1]
-        if os.path.isfile(arg) and arg.lower().endswith(".json"):
+    for arg in sys.argv[1:]:
+        if arg == "--profile" or arg.startswith("--profile="):
+            profile = arg.partition("=")[2] or "1"
+        elif arg == "--startup-time" or arg.startswith("--startup-time="):
+            startup = StartupTimer(arg.partition("=")[2] or None)
+        elif arg.startswith("--sheet-memory="):
+            sheet_memory_limit = int(arg.partition("=")[2]) * 1024 * 1024
+        elif os.path.isfile(arg) and arg.lower().endswith((".json", COLUMNAR_EXT)):
             init_file = arg
-    app = JournalApp(init_file=init_file)
+    instrumentation = None
+    if profile:
+        instrumentation = Instrumentation(profile if profile.lower().endswith(".json") else None)
+        instrumentation.install()
+    app = JournalApp(init_file=init_file, instrumentation=instrumentation, sheet_memory_limit=sheet_memory_limit,
+                     startup=startup)
     app.mainloop()